@@ -0,0 +1,215 @@
+import asyncio
+import os
+from collections import deque
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+import metrics
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 全局同时运行的对话管道（mcp_main / WS 转发）上限
+ADMISSION_MAX_INFLIGHT = int(os.getenv('ADMISSION_MAX_INFLIGHT', 32))
+# 单个用户同时运行的对话上限
+ADMISSION_MAX_PER_USER = int(os.getenv('ADMISSION_MAX_PER_USER', 2))
+# 等待队列长度上限，队列满时直接返回 429
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 64))
+# 单个用户在队列中最多排队的请求数
+ADMISSION_MAX_QUEUED_PER_USER = int(os.getenv('ADMISSION_MAX_QUEUED_PER_USER', 2))
+# 排队的最长等待时间（秒）
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 60.0))
+# 向客户端推送排队位置的间隔（秒）
+ADMISSION_POSITION_INTERVAL = float(os.getenv('ADMISSION_POSITION_INTERVAL', 2.0))
+
+
+class AdmissionRejected(Exception):
+    """容量与等待队列均已满，或排队超时"""
+
+
+class _Waiter:
+    __slots__ = ("user", "future")
+
+    def __init__(self, user: str):
+        self.user = user
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionController:
+    """
+    对话入口的准入控制：全局并发上限 + 每用户并发上限 + 有界 FIFO 等待队列。
+    队列中的请求按顺序放行，但会跳过已达到个人上限的用户，避免一个用户堵住队头。
+    """
+
+    def __init__(
+        self,
+        max_inflight: int = ADMISSION_MAX_INFLIGHT,
+        max_per_user: int = ADMISSION_MAX_PER_USER,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        max_queued_per_user: int = ADMISSION_MAX_QUEUED_PER_USER,
+    ):
+        self.max_inflight = max_inflight
+        self.max_per_user = max_per_user
+        self.queue_size = queue_size
+        self.max_queued_per_user = max_queued_per_user
+        self.inflight = 0
+        self._per_user: Dict[str, int] = {}
+        self._queued_per_user: Dict[str, int] = {}
+        self._waiters: Deque[_Waiter] = deque()
+
+    # ------------------------------
+    # 状态判断
+    # ------------------------------
+    def _can_run(self, user: str) -> bool:
+        return self.inflight < self.max_inflight and self._per_user.get(user, 0) < self.max_per_user
+
+    def would_reject(self, user: str) -> bool:
+        """快速判断：无法立即运行且不能再排队"""
+        if self._can_run(user):
+            return False
+        return len(self._waiters) >= self.queue_size or self._queued_per_user.get(user, 0) >= self.max_queued_per_user
+
+    def position(self, waiter: _Waiter) -> int:
+        try:
+            return self._waiters.index(waiter) + 1
+        except ValueError:
+            return 0
+
+    # ------------------------------
+    # 占用 / 释放
+    # ------------------------------
+    def _grant(self, user: str) -> None:
+        self.inflight += 1
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+
+    def try_acquire(self, user: str) -> bool:
+        # 释放名额时会立即放行可运行的排队者，因此队列中剩下的都是受个人上限限制的请求
+        if self._can_run(user):
+            self._grant(user)
+            return True
+        return False
+
+    def enqueue(self, user: str) -> _Waiter:
+        if self.would_reject(user):
+            metrics.inc("admission_rejected_total")
+            raise AdmissionRejected("服务繁忙，请稍后重试")
+        waiter = _Waiter(user)
+        self._waiters.append(waiter)
+        self._queued_per_user[user] = self._queued_per_user.get(user, 0) + 1
+        metrics.inc("admission_queued_total")
+        return waiter
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        remaining = self._queued_per_user.get(waiter.user, 1) - 1
+        if remaining > 0:
+            self._queued_per_user[waiter.user] = remaining
+        else:
+            self._queued_per_user.pop(waiter.user, None)
+
+    def release(self, user: str) -> None:
+        self.inflight -= 1
+        remaining = self._per_user.get(user, 1) - 1
+        if remaining > 0:
+            self._per_user[user] = remaining
+        else:
+            self._per_user.pop(user, None)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for waiter in list(self._waiters):
+            if self.inflight >= self.max_inflight:
+                break
+            if waiter.future.done() or not self._can_run(waiter.user):
+                continue
+            self._dequeue(waiter)
+            self._grant(waiter.user)
+            waiter.future.set_result(True)
+
+    def cancel(self, waiter: _Waiter) -> None:
+        """放弃排队；若刚好已被放行，则归还名额"""
+        self._dequeue(waiter)
+        if waiter.future.done() and not waiter.future.cancelled():
+            self.release(waiter.user)
+        else:
+            waiter.future.cancel()
+
+    async def queue_positions(self, waiter: _Waiter, timeout: float = ADMISSION_QUEUE_TIMEOUT) -> AsyncIterator[int]:
+        """
+        等待被放行，期间每隔 ADMISSION_POSITION_INTERVAL 秒产出当前队列位置；
+        超时抛出 AdmissionRejected，提前退出时自动退出队列。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while not waiter.future.done():
+                yield self.position(waiter)
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    metrics.inc("admission_timeout_total")
+                    raise AdmissionRejected(f"排队超时（{timeout:g}秒），请稍后重试")
+                await asyncio.wait({waiter.future}, timeout=min(ADMISSION_POSITION_INTERVAL, remaining))
+        except BaseException:
+            self.cancel(waiter)
+            raise
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user: str,
+        on_wait: Optional[Callable[[int], Awaitable[None]]] = None,
+        timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ) -> AsyncIterator[None]:
+        """获取一个运行名额；排队期间调用 on_wait(队列位置)，队列已满或等待超时抛出 AdmissionRejected"""
+        if not self.try_acquire(user):
+            waiter = self.enqueue(user)
+            async with aclosing(self.queue_positions(waiter, timeout)) as positions:
+                async for position in positions:
+                    if on_wait is not None:
+                        await on_wait(position)
+        try:
+            yield
+        finally:
+            self.release(user)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inflight": self.inflight,
+            "queued": len(self._waiters),
+            "max_inflight": self.max_inflight,
+            "max_per_user": self.max_per_user,
+            "queue_size": self.queue_size,
+        }
+
+
+admission = AdmissionController()
+
+
+def sse_queue(position: int) -> str:
+    return f"event: queue\ndata: ⏳ 排队中，前方还有 {max(position - 1, 0)} 个请求\n\n"
+
+
+async def admitted_sse(user: str, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """获得运行名额后才开始执行 mcp_main；排队期间推送排队位置事件"""
+    if not admission.try_acquire(user):
+        try:
+            waiter = admission.enqueue(user)
+            async with aclosing(admission.queue_positions(waiter)) as positions:
+                async for position in positions:
+                    yield sse_queue(position)
+        except AdmissionRejected as e:
+            await stream.aclose()
+            yield f"data: ❌ {e}\n\n"
+            return
+    try:
+        async with aclosing(stream):
+            async for frame in stream:
+                yield frame
+    finally:
+        admission.release(user)
@@ -0,0 +1,197 @@
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, FrozenSet, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+from schema_cache import schema_cache
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+# 答案有效期（秒）；类似“今天的订单数”这类问题依赖时间，不宜过长
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 300.0))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 512))
+# 字符 n-gram Jaccard 相似度阈值；默认 1.0，只接受归一化后完全相同的问题。
+# 小于 1.0 时启用模糊匹配，但数字与否定词必须完全一致（“客户 1234” 与 “客户 1235” 不会互相命中）
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 1.0))
+ANSWER_CACHE_NGRAM = int(os.getenv('ANSWER_CACHE_NGRAM', 2))
+
+# 只去掉不影响语义的空白与标点：比较运算符、正负号、百分号、小数点和数字分隔符保留在键中
+_NOISE = re.compile(r"(?:(?!\.\d|(?<=\d)[,_]\d)(?:[^\w<>=!+\-.%]|[._]))+", re.UNICODE)
+_NUMBER = re.compile(r"[-+]?\d+(?:[.,_]\d+)*%?")
+_COMPARISON = re.compile(r"[<>]=?|[!=]=?|[≥≤≠]|大于|小于|高于|低于|超过|不足|以上|以下|至少|至多|最多|最少")
+_NEGATION = re.compile(r"[不没未无非别勿否]|\b(?:not|no|never|none|nor|without|except|excluding)\b|n't\b")
+
+
+def normalize_question(question: str) -> str:
+    """全角转半角、小写，并去掉空白和无语义的标点"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return _NOISE.sub("", text)
+
+
+def guard_terms(question: str) -> Tuple[Tuple[str, ...], ...]:
+    """命中缓存时必须完全相同的部分：问题中的数字（含符号）、比较词与否定词"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    return (
+        tuple(_NUMBER.findall(text)),
+        tuple(_COMPARISON.findall(text)),
+        tuple(sorted(_NEGATION.findall(text))),
+    )
+
+
+def ngrams(text: str, n: int = ANSWER_CACHE_NGRAM) -> FrozenSet[str]:
+    if len(text) <= n:
+        return frozenset([text])
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class _Answer:
+    def __init__(self, grams: FrozenSet[str], guard: Tuple[Tuple[str, ...], ...], frames: List[str]):
+        self.grams = grams
+        self.guard = guard
+        self.frames = frames
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """
+    自然语言问题的最终答案缓存。
+    按归一化文本精确匹配，或按字符 n-gram 相似度模糊匹配；
+    数据库结构缓存的 generation 或目标库变化时整体失效。
+    """
+
+    def __init__(
+        self,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: "OrderedDict[Tuple[str, str], _Answer]" = OrderedDict()
+        self._version: Tuple[str, int] = (schema_cache.target, schema_cache.generation)
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self) -> None:
+        version = (schema_cache.target, schema_cache.generation)
+        if version != self._version:
+            self._version = version
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+
+    def get(self, namespace: str, question: str) -> Optional[List[str]]:
+        self._check_version()
+        text = normalize_question(question)
+        guard = guard_terms(question)
+        now = time.monotonic()
+        entry = self._entries.get((namespace, text))
+        # 精确命中同样校验数字 / 比较词 / 否定词，防止归一化遗漏导致不同问题共用答案
+        if entry is not None and now - entry.created_at <= self.ttl and entry.guard == guard:
+            self._entries.move_to_end((namespace, text))
+            self.hits += 1
+            metrics.inc("cache_requests_total", labels={"cache": "answer", "result": "hit"})
+            return entry.frames
+
+        if self.threshold < 1.0:
+            grams = ngrams(text)
+            best, best_score = None, self.threshold
+            for (entry_namespace, _), candidate in self._entries.items():
+                if entry_namespace != namespace or now - candidate.created_at > self.ttl:
+                    continue
+                if candidate.guard != guard:
+                    continue
+                score = jaccard(grams, candidate.grams)
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is not None:
+                self.hits += 1
+                self.fuzzy_hits += 1
+                metrics.inc("cache_requests_total", labels={"cache": "answer", "result": "fuzzy_hit"})
+                return best.frames
+
+        self.misses += 1
+        metrics.inc("cache_requests_total", labels={"cache": "answer", "result": "miss"})
+        return None
+
+    def put(self, namespace: str, question: str, frames: List[str]) -> None:
+        if not frames:
+            return
+        self._check_version()
+        text = normalize_question(question)
+        self._entries.pop((namespace, text), None)
+        self._entries[(namespace, text)] = _Answer(ngrams(text), guard_terms(question), frames)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "threshold": self.threshold,
+        }
+
+
+answer_cache = AnswerCache()
+
+
+def cached_answer(question: str, use_cache: bool = True) -> Optional[List[str]]:
+    """
+    查询 SSE 接口的答案缓存；应在准入控制与 token 额度检查之前调用，
+    命中时直接 replay_sse，不排队、不扣额度。
+    """
+    if not (ANSWER_CACHE_ENABLED and use_cache):
+        return None
+    return answer_cache.get("sse", question)
+
+
+async def replay_sse(frames: List[str]) -> AsyncIterator[str]:
+    for frame in frames:
+        yield frame
+
+
+async def cached_sse(question: str, stream: AsyncIterator[str], use_cache: bool = True) -> AsyncIterator[str]:
+    """
+    包装未命中缓存时 mcp_main 的 SSE 输出：边透传边记录，完整且无错误的答案写入缓存。
+    """
+    if not (ANSWER_CACHE_ENABLED and use_cache):
+        async for frame in stream:
+            yield frame
+        return
+
+    recorded: List[str] = []
+    failed = False
+    async for frame in stream:
+        # 进度 / 排队等命名事件不回放；出现错误帧的答案不缓存
+        if frame.startswith("event: "):
+            pass
+        elif frame.startswith("data: ❌") or frame.startswith("data: {\"error\""):
+            failed = True
+        else:
+            recorded.append(frame)
+        yield frame
+    if not failed:
+        answer_cache.put("sse", question, recorded)
@@ -0,0 +1,134 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+import metrics
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# 按模块单独设置级别，例如 "ws_relay=WARNING,llmapi4=DEBUG"
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+# json = 每行一个 JSON 对象；text = 便于本地阅读的单行文本
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# 日志队列长度上限；队列满时丢弃新日志，不阻塞事件循环
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# 当前请求 / 会话的关联 ID，随 asyncio 任务上下文传递
+correlation_id: ContextVar[str] = ContextVar("correlation_id", default="-")
+
+
+def set_correlation_id(value: Optional[str] = None) -> str:
+    value = value or uuid.uuid4().hex[:12]
+    correlation_id.set(value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "cid": getattr(record, "cid", "-"),
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(cid)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return text
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """只负责入队（在调用方线程中），格式化与写出由后台线程完成；队列满时丢弃"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在入队前固定消息与关联 ID，后台线程中已无法读取请求上下文
+        record.cid = correlation_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> None:
+    """根 logger 只挂一个队列 handler；由后台线程写 stdout。重复调用无副作用。"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL.upper())
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """停止后台线程并写出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+# ----------------------------------------------------
+# 高频事件（逐帧 / 逐块）的限频
+# ----------------------------------------------------
+_last_emitted: Dict[str, float] = {}
+
+
+def throttled(key: str, interval: float) -> bool:
+    """同一 key 在 interval 秒内只放行一次"""
+    now = time.monotonic()
+    if now - _last_emitted.get(key, float("-inf")) < interval:
+        return False
+    _last_emitted[key] = now
+    return True
@@ -0,0 +1,116 @@
+import asyncio
+import os
+from typing import Any, Callable, Optional, Type
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 是否使用异步驱动（SQLite: aiosqlite，Postgres: asyncpg）；未安装驱动时自动回退到线程池
+DB_ASYNC = os.getenv('DB_ASYNC', '1') == '1'
+# 连接池参数（SQLite 以外的数据库）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5.0))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+# SQLite 写锁等待时间（秒）
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 5.0))
+
+_ASYNC_DRIVERS = {
+    "sqlite": ("sqlite+aiosqlite", "aiosqlite"),
+    "postgresql": ("postgresql+asyncpg", "asyncpg"),
+    "postgres": ("postgresql+asyncpg", "asyncpg"),
+}
+
+
+def async_url(url: str) -> Optional[str]:
+    """把同步连接串转换为对应的异步驱动连接串；不支持的数据库返回 None"""
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if not sep or dialect not in _ASYNC_DRIVERS:
+        return None
+    return f"{_ASYNC_DRIVERS[dialect][0]}://{rest}"
+
+
+def _driver_available(url: str) -> bool:
+    dialect = url.partition("://")[0].split("+", 1)[0]
+    try:
+        __import__(_ASYNC_DRIVERS[dialect][1])
+    except ImportError:
+        logger.warning("未安装 %s，数据库访问回退到线程池", _ASYNC_DRIVERS[dialect][1])
+        return False
+    return True
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # WAL 让读不阻塞写，适合认证查询与管理写入并存的场景
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def create_async_db_engine(url: str) -> Optional[AsyncEngine]:
+    if not DB_ASYNC:
+        return None
+    target = async_url(url)
+    if target is None or not _driver_available(url):
+        return None
+    if target.startswith("sqlite"):
+        engine = create_async_engine(target, connect_args={"timeout": SQLITE_BUSY_TIMEOUT})
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+        return engine
+    return create_async_engine(
+        target,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+class AsyncDB:
+    """
+    在请求路径上执行同步风格的数据库函数 fn(session, *args)，不阻塞事件循环：
+    有异步驱动时通过 AsyncSession.run_sync 在异步连接上执行，否则放到线程池中使用同步会话。
+    同一份查询代码两种模式通用；返回的 ORM 对象已脱离会话，属性在提交后不会过期。
+    """
+
+    def __init__(self, engine: Engine, session_class: Type[Session] = Session):
+        self.engine = engine
+        self.async_engine = create_async_db_engine(engine.url.render_as_string(hide_password=False))
+        self._sync_sessions = sessionmaker(bind=engine, class_=session_class, expire_on_commit=False)
+        self._async_sessions = None
+        if self.async_engine is not None:
+            self._async_sessions = async_sessionmaker(
+                self.async_engine, expire_on_commit=False, sync_session_class=session_class
+            )
+
+    def _run_in_thread(self, fn: Callable[..., Any], *args) -> Any:
+        with self._sync_sessions() as session:
+            return fn(session, *args)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        if self._async_sessions is not None:
+            async with self._async_sessions() as session:
+                return await session.run_sync(fn, *args)
+        return await asyncio.to_thread(self._run_in_thread, fn, *args)
+
+    async def dispose(self) -> None:
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+
+    def stats(self) -> dict:
+        engine = self.async_engine.sync_engine if self.async_engine is not None else self.engine
+        return {"async": self.async_engine is not None, "pool": engine.pool.status()}
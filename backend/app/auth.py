@@ -1,81 +1,149 @@
 import os
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.security import OAuth2PasswordRequestForm
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
-from sqlmodel import Session
-from crud import get_user_by_username, create_user, verify_password
+from typing import Optional
+from dotenv import load_dotenv
+from crud import get_user_by_username, create_user, update_password_hash, list_users as crud_list_users
+from models import User
 from schemas import Token, UserCreate, DBConfigIn
-from deps import get_db
+from deps import async_db
+from password_hashing import password_hasher, HasherBusy
+from user_cache import token_cache, get_cached_user, cache_user, invalidate_user, watch_user_model
 
+load_dotenv()
 router = APIRouter()
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
+# 统一的 token 格式：HS256，sub=用户名，exp=签发时间 + JWT_EXPIRE_MINUTES
+# 兼容旧配置：未设置 JWT_SECRET_KEY 时读取 JWT_SECRET
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY") or os.getenv("JWT_SECRET", "super-secret-key")
+JWT_ALGORITHM = "HS256"
+JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", 60))
 
-SECRET_KEY = os.getenv("JWT_SECRET", "change-me")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60*24
+# 用户被修改/删除时失效认证缓存
+watch_user_model(User)
 
-def create_access_token(data: dict, expires_delta: timedelta | None = None):
+# ------------------------------
+# JWT helpers
+# ------------------------------
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=JWT_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+def verify_jwt_token(token: str) -> str:
+    # 已验证过的 token 在 exp 之前直接返回用户名，不再重复解码验签
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    try:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise HTTPException(status_code=401, detail="Invalid JWT: missing subject")
+        if payload.get("exp") is not None:
+            token_cache.put(token, username, float(payload["exp"]))
+        return username
+    except JWTError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid or expired token: {str(e)}")
+
+# ------------------------------
+# Auth Dependency
+# ------------------------------
+async def get_current_active_user(authorization: str = Header(None)) -> User:
+    """
+    从 Authorization: Bearer <token> 中解析并验证 JWT，
+    返回仍存在且已激活的用户。
+    """
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing Authorization header")
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Invalid Authorization header format")
+    username = verify_jwt_token(parts[1])
+    # 短时缓存，未命中时异步查询，避免阻塞事件循环
+    user = get_cached_user(username)
+    if user is None:
+        user = await async_db.run(get_user_by_username, username)
+        if user is not None:
+            cache_user(user)
+    if not user or not user.is_active:
+        raise HTTPException(status_code=401, detail="用户不存在或已禁用")
+    return user
+
+async def get_current_superuser(current: User = Depends(get_current_active_user)) -> User:
+    if not current.is_superuser:
+        raise HTTPException(status_code=403, detail="superuser only")
+    return current
+
+# ------------------------------
+# 登录 / 注册（main 的 /register、/api/login 与本路由共用）
+# ------------------------------
+async def run_hasher(call):
+    """bcrypt 在独立进程池中计算；排队已满时返回 503"""
+    try:
+        return await call
+    except HasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+async def authenticate(username: str, password: str) -> Optional[User]:
+    """校验密码；成本因子变化时顺带用新参数重新计算并保存密码哈希"""
+    user = await async_db.run(get_user_by_username, username)
+    if not user or not user.hashed_password:
+        return None
+    verified, new_hash = await run_hasher(password_hasher.verify_and_update(password, user.hashed_password))
+    if not verified:
+        return None
+    if new_hash:
+        await async_db.run(update_password_hash, user.username, new_hash)
+    return user
+
+async def register_user(username: str, password: str, email=None, full_name=None) -> User:
+    if await async_db.run(get_user_by_username, username):
+        raise HTTPException(status_code=400, detail="Username already registered")
+    hashed = await run_hasher(password_hasher.hash(password))
+    user = await async_db.run(create_user, username, hashed, email, full_name)
+    invalidate_user(username)
+    return user
 
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = get_user_by_username(db, form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await authenticate(form_data.username, form_data.password)
+    if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     token = create_access_token({"sub": user.username})
     return {"access_token": token, "token_type": "bearer"}
 
 @router.post("/register", status_code=201)
-def register(u: UserCreate, db: Session = Depends(get_db)):
-    if get_user_by_username(db, u.username):
-        raise HTTPException(status_code=400, detail="username exists")
-    user = create_user(db, u.username, u.password, u.email, u.full_name)
+async def register(u: UserCreate):
+    user = await register_user(u.username, u.password, u.email, u.full_name)
     return {"id": user.id, "username": user.username}
 
-from fastapi import Security
-
-def get_current_active_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    user = get_user_by_username(db, username)
-    if not user or not user.is_active:
-        raise HTTPException(status_code=401, detail="Inactive user")
-    return user
-
 # admin endpoints
 from crud import get_db_config, set_db_config
-from sqlmodel import Session
+from schema_cache import schema_cache
 
 @router.get("/me")
 def me(current=Depends(get_current_active_user)):
     return {"username": current.username, "email": current.email, "is_superuser": current.is_superuser}
 
 @router.get("/admin/users")
-def list_users(db: Session = Depends(get_db), current=Depends(get_current_active_user)):
-    if not current.is_superuser:
-        raise HTTPException(status_code=403, detail="superuser only")
-    users = db.exec("SELECT id, username, email, is_active, is_superuser FROM user").all()
-    return users
+async def list_users(current=Depends(get_current_superuser)):
+    users = await async_db.run(crud_list_users)
+    return [
+        {"id": u.id, "username": u.username, "email": u.email, "is_active": u.is_active, "is_superuser": u.is_superuser}
+        for u in users
+    ]
 
 @router.post("/admin/db-config")
-def set_dbcfg(cfg: DBConfigIn, db: Session = Depends(get_db), current=Depends(get_current_active_user)):
-    if not current.is_superuser:
-        raise HTTPException(status_code=403, detail="superuser only")
-    return set_db_config(db, cfg.target_url)
+async def set_dbcfg(cfg: DBConfigIn, current=Depends(get_current_superuser)):
+    result = await async_db.run(set_db_config, cfg.target_url)
+    schema_cache.set_target(cfg.target_url)
+    return result
 
 @router.get("/admin/db-config")
-def get_dbcfg(db: Session = Depends(get_db), current=Depends(get_current_active_user)):
-    if not current.is_superuser:
-        raise HTTPException(status_code=403, detail="superuser only")
-    cfg = get_db_config(db)
+async def get_dbcfg(current=Depends(get_current_superuser)):
+    cfg = await async_db.run(get_db_config)
     return cfg or {}
@@ -0,0 +1,74 @@
+import asyncio
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+from fastapi import Request
+
+import metrics
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 检查 SSE 客户端是否断开的轮询间隔（秒）
+DISCONNECT_POLL_INTERVAL = float(os.getenv('DISCONNECT_POLL_INTERVAL', 0.5))
+# 取消上游任务后等待其清理（关闭 httpx 流、归还 MCP 会话）的最长时间
+CANCEL_GRACE = float(os.getenv('CANCEL_GRACE', 2.0))
+# 生产者与客户端之间最多缓冲的帧数
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 16))
+
+
+async def _wait_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def cancel_task(task: Optional[asyncio.Task], counter: str) -> None:
+    """取消仍在运行的上游任务并计入放弃的工作量"""
+    if task is None or task.done():
+        return
+    task.cancel()
+    metrics.inc(counter)
+    await asyncio.wait({task}, timeout=CANCEL_GRACE)
+
+
+async def cancel_on_disconnect(request: Request, stream: AsyncIterator[str], name: str = "sse") -> AsyncIterator[str]:
+    """
+    在独立任务中运行 mcp_main 等上游生成器，客户端断开时立即取消它：
+    正在进行的工具调用、httpx 流式请求随之取消，MCP 会话归还连接池。
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    async def produce() -> None:
+        async with aclosing(stream):
+            async for item in stream:
+                await queue.put(item)
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(_wait_disconnect(request))
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, producer, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            if watcher in done:
+                logger.info("%s 客户端已断开，取消上游任务", name)
+                return
+            # 上游正常结束：先把缓冲区中剩余的帧发完
+            while not queue.empty():
+                yield queue.get_nowait()
+            if not producer.cancelled() and producer.exception():
+                logger.error("%s 上游任务异常: %r", name, producer.exception())
+            return
+    finally:
+        watcher.cancel()
+        await cancel_task(producer, f"{name}_abandoned_total")
+
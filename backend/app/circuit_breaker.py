@@ -0,0 +1,198 @@
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+BREAKER_ENABLED = os.getenv('BREAKER_ENABLED', '1') == '1'
+# 统计失败率的滑动时间窗口（秒），以及窗口内至少多少次调用才开始判断
+BREAKER_WINDOW = float(os.getenv('BREAKER_WINDOW', 30.0))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 5))
+# 窗口内失败率达到该比例时熔断
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+# 熔断后多久进入半开状态放行探测请求，以及半开状态下同时放行的探测数
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 15.0))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv('BREAKER_HALF_OPEN_CALLS', 1))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(Exception):
+    """依赖处于熔断状态，调用被直接拒绝"""
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        self.breaker = breaker
+        self.retry_after = breaker.retry_after()
+        super().__init__(f"{breaker.title}暂不可用，请 {max(self.retry_after, 1):.0f} 秒后重试")
+
+
+_breakers: Dict[str, "CircuitBreaker"] = {}
+
+
+class _Attempt:
+    """一次被放行的调用；流式调用可在收到首个数据时提前 settle，之后的异常不再计入熔断"""
+
+    __slots__ = ("breaker", "probe", "settled")
+
+    def __init__(self, breaker: "CircuitBreaker", probe: bool):
+        self.breaker = breaker
+        self.probe = probe
+        self.settled = False
+
+    def settle(self, ok: bool = True) -> None:
+        if self.settled:
+            return
+        self.settled = True
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        self.release()
+
+    def release(self) -> None:
+        if self.probe:
+            self.probe = False
+            self.breaker._probes -= 1
+
+
+class CircuitBreaker:
+    """
+    单个外部依赖的熔断器：
+    closed —— 窗口内失败率超过阈值 ——> open —— 冷却结束 ——> half_open
+    half_open 下放行少量探测请求：成功则 closed，失败则重新 open。
+    is_failure 决定哪些异常计为依赖故障（例如 4xx 参数错误不应触发熔断）；取消不计入。
+    """
+
+    def __init__(self, name: str, title: str, is_failure: Callable[[BaseException], bool] = lambda exc: True):
+        self.name = name
+        self.title = title
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        _breakers[name] = self
+
+    # ------------------------------
+    # 状态
+    # ------------------------------
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning("熔断器 %s: %s -> %s", self.name, self.state, state)
+        metrics.inc("circuit_transitions_total", labels={"breaker": self.name, "to": state})
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        self._calls.clear()
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(self._opened_at + BREAKER_OPEN_SECONDS - time.monotonic(), 0.0)
+
+    @property
+    def is_open(self) -> bool:
+        """是否会直接拒绝新请求（冷却已结束、可以探测时返回 False）"""
+        return BREAKER_ENABLED and self.state == OPEN and self.retry_after() > 0
+
+    def _prune(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > BREAKER_WINDOW:
+            self._calls.popleft()
+
+    def failure_rate(self) -> float:
+        self._prune(time.monotonic())
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    # ------------------------------
+    # 调用结果
+    # ------------------------------
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            self._transition(CLOSED)
+            return
+        self._calls.append((time.monotonic(), True))
+
+    def record_failure(self) -> None:
+        if self.state == HALF_OPEN:
+            self._transition(OPEN)
+            return
+        now = time.monotonic()
+        self._calls.append((now, False))
+        self._prune(now)
+        if self.state == CLOSED and len(self._calls) >= BREAKER_MIN_CALLS \
+                and self.failure_rate() >= BREAKER_FAILURE_RATE:
+            self._transition(OPEN)
+
+    def _admit(self) -> bool:
+        """返回本次调用是否占用了一个半开探测名额；熔断中则抛出 CircuitOpen"""
+        if not BREAKER_ENABLED:
+            return False
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                metrics.inc("circuit_rejected_total", labels={"breaker": self.name})
+                raise CircuitOpen(self)
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= BREAKER_HALF_OPEN_CALLS:
+                metrics.inc("circuit_rejected_total", labels={"breaker": self.name})
+                raise CircuitOpen(self)
+            self._probes += 1
+            return True
+        return False
+
+    @asynccontextmanager
+    async def call(self) -> AsyncIterator[_Attempt]:
+        """
+        包裹一次依赖调用：`async with breaker.call(): ...`
+        流式调用用 `async with breaker.call() as attempt:` 并在首个数据到达时 attempt.settle()，
+        避免下游消费耗时或流中途断开被算作依赖故障。
+        """
+        attempt = _Attempt(self, self._admit())
+        try:
+            yield attempt
+        except Exception as exc:
+            if not attempt.settled and self.is_failure(exc):
+                attempt.settle(ok=False)
+            raise
+        else:
+            attempt.settle()
+        finally:
+            attempt.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state if BREAKER_ENABLED else "disabled",
+            "failure_rate": round(self.failure_rate(), 3),
+            "calls": len(self._calls),
+            "retry_after": round(self.retry_after(), 1),
+        }
+
+
+def open_breaker(*breakers: CircuitBreaker) -> Optional[CircuitBreaker]:
+    """返回第一个正在拒绝请求的熔断器，用于在排队、扣额度之前快速失败"""
+    for breaker in breakers:
+        if breaker.is_open:
+            return breaker
+    return None
+
+
+async def fail_fast_sse(breaker: CircuitBreaker) -> AsyncIterator[str]:
+    yield f"data: ❌ {CircuitOpen(breaker)}\n\n"
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
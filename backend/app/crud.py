@@ -1,40 +1,71 @@
-from sqlmodel import Session, select
+from sqlmodel import Session, SQLModel, select
+from sqlalchemy import inspect, literal, text
 from models import User, DBConfig
-from passlib.context import CryptContext
 from datetime import datetime
+# 与 main 共用同一套 bcrypt 配置（成本因子、72 字节截断）
+from password_hashing import hash_password
+from app_logging import get_logger
 
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = get_logger(__name__)
 
 def get_password_hash(password: str):
     """
-    计算密码的哈希值。
-    注意：为了遵守 bcrypt 的 72 字节限制，我们确保密码在哈希前被截断。
+    计算密码的哈希值（同步，仅用于初始化等离线路径）。
+    请求路径请使用 password_hashing.password_hasher，在独立进程池中计算。
     """
-    # 修复：将密码编码为 bytes，并安全地截断到 72 字节，以避免 ValueError。
-    password_bytes = password.encode('utf8')
-    return pwd_ctx.hash(password_bytes[:72])
+    return hash_password(password)
 
-def verify_password(plain, hashed):
-    return pwd_ctx.verify(plain, hashed)
+def migrate_schema(engine):
+    """
+    建表，并为已有表补齐模型中新增的列（轻量迁移，只加列不改列）。
+    旧的 users 表（main 原来的 SQLAlchemy 模型）会补上 email / full_name / is_superuser / created_at。
+    """
+    SQLModel.metadata.create_all(engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    ddl += " DEFAULT " + str(literal(default).compile(engine, compile_kwargs={"literal_binds": True}))
+                conn.execute(text(ddl))
+                logger.info("数据库迁移：%s 新增列 %s", table.name, column.name)
 
-def init_db(engine):
+def init_db(engine, username: str, password: str):
+    """
+    创建初始管理员（仅当还没有任何超级用户且该用户名未被占用时）。
+    账号密码必须由调用方显式提供，不内置默认密码。
+    """
     with Session(engine) as s:
-        q = s.exec(select(User)).first()
-        if not q:
-            # 这里的 "admin123" 密码长度是安全的 (8 字节)
-            admin = User(username="admin", full_name="Administrator", email="admin@example.com",
-                         hashed_password=get_password_hash("admin123"), is_superuser=True)
+        has_admin = s.exec(select(User).where((User.is_superuser == True) | (User.username == username))).first()  # noqa: E712
+        if not has_admin:
+            admin = User(username=username, full_name="Administrator",
+                         hashed_password=get_password_hash(password), is_superuser=True)
             s.add(admin)
             s.commit()
+            logger.info("已创建初始管理员：%s", username)
 
 def get_user_by_username(db: Session, username: str):
     return db.exec(select(User).where(User.username == username)).first()
 
-def create_user(db: Session, username: str, password: str, email=None, full_name=None):
-    user = User(username=username, hashed_password=get_password_hash(password), email=email, full_name=full_name)
+def create_user(db: Session, username: str, hashed_password: str, email=None, full_name=None):
+    user = User(username=username, hashed_password=hashed_password, email=email, full_name=full_name)
     db.add(user); db.commit(); db.refresh(user)
     return user
 
+def update_password_hash(db: Session, username: str, hashed_password: str):
+    user = get_user_by_username(db, username)
+    if user is not None:
+        user.hashed_password = hashed_password
+        db.commit()
+
+def list_users(db: Session):
+    return db.exec(select(User)).all()
+
 def get_db_config(db: Session):
     cfg = db.exec(select(DBConfig)).first()
     return cfg
@@ -1,11 +1,8 @@
-from sqlalchemy import create_engine, text 
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker, declarative_base
-import os
-from dotenv import load_dotenv
-load_dotenv()
-DATABASE_URL = os.getenv('SERVER_DATABASE_URL')
-  
-engine = create_engine(DATABASE_URL, echo=True, future=True)
+# 与认证共用同一个 engine / 连接池（见 deps.py），不再单独建池
+from deps import engine
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
@@ -1,9 +1,20 @@
 import os
+from dotenv import load_dotenv
 from sqlmodel import Session, create_engine
 from typing import Generator
+from async_db import AsyncDB
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data.db")
-engine = create_engine(DATABASE_URL, echo=False)
+load_dotenv()
+# 用户与 DBConfig 的唯一存储，默认沿用 main 原来的 users.db
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./users.db")
+# 是否打印每条 SQL（仅调试时开启）
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL, echo=SQL_ECHO, connect_args={"check_same_thread": False})
+else:
+    engine = create_engine(DATABASE_URL, echo=SQL_ECHO, pool_pre_ping=True)
+# 请求路径使用：fn(session, *args) 在异步驱动或线程池中执行
+async_db = AsyncDB(engine, session_class=Session)
 
 def get_db() -> Generator:
     with Session(engine) as s:
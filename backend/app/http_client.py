@@ -0,0 +1,69 @@
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+import httpx
+
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 是否启用 HTTP/2（需要安装 h2，即 httpx[http2]）
+LLM_HTTP2 = os.getenv('LLM_HTTP2', '1') == '1'
+# 连接池限制
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 100))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60.0))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5.0))
+# 决策阶段（非流式）超时，沿用原来的 FIRST_PASS_TIMEOUT
+FIRST_PASS_TIMEOUT = float(os.getenv('FIRST_PASS_TIMEOUT', 10.0))
+# 流式阶段：两个数据块之间的最大等待时间
+STREAM_READ_TIMEOUT = float(os.getenv('STREAM_READ_TIMEOUT', 60.0))
+
+DECISION_TIMEOUT = httpx.Timeout(FIRST_PASS_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+STREAM_TIMEOUT = httpx.Timeout(STREAM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _http2_available() -> bool:
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("未安装 h2，LLM 客户端回退到 HTTP/1.1")
+        return False
+    return True
+
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=STREAM_TIMEOUT,
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取应用级共享的 LLM HTTP 客户端（keep-alive 连接池复用 TCP/TLS 握手）"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = create_http_client()
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+import httpx
+
+import metrics
+from app_logging import get_logger
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 备用路由：配置了与主路由不同的 LLM_BACKUP_URL 或 MODEL_SECOND_PASS 时才启用（对冲与故障转移）
+LLM_BACKUP_URL = os.getenv('LLM_BACKUP_URL')
+LLM_BACKUP_API_KEY = os.getenv('LLM_BACKUP_API_KEY')
+MODEL_SECOND_PASS = os.getenv('MODEL_SECOND_PASS')
+# 对冲请求：主路由超过最近延迟的该百分位仍未返回时，向备用路由再发一份；没有独立的备用路由时不生效
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', '1') == '1'
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', 95.0))
+# 对冲延迟的上下限（秒）
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', 0.5))
+LLM_HEDGE_MAX_DELAY = float(os.getenv('LLM_HEDGE_MAX_DELAY', 8.0))
+# 延迟窗口长度；样本数达到 LLM_HEDGE_MIN_SAMPLES 之前不对冲
+LLM_HEDGE_WINDOW = int(os.getenv('LLM_HEDGE_WINDOW', 200))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+# 最近窗口内对冲请求占比上限，避免上游整体变慢时请求量翻倍
+LLM_HEDGE_MAX_RATIO = float(os.getenv('LLM_HEDGE_MAX_RATIO', 0.2))
+
+
+def should_failover(exc: BaseException) -> bool:
+    """超时、连接错误、429 / 5xx、无法解析的响应与熔断切换到备用路由；其余 4xx 说明请求本身有误，不再重试"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(exc, (httpx.HTTPError, json.JSONDecodeError, CircuitOpen))
+
+
+# 主 LLM 端点的熔断器；流式阶段（llmapi4.stream_llm_response）共用
+llm_breaker = CircuitBreaker("llm", "LLM 服务", is_failure=should_failover)
+
+
+class LLMRoute:
+    """一个可调用的 LLM 端点 + 模型"""
+
+    def __init__(self, name: str, url: str, model: str, headers: Dict[str, str], breaker: CircuitBreaker = llm_breaker):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.headers = headers
+        self.breaker = breaker
+
+    async def complete(self, http_client: httpx.AsyncClient, payload: Dict[str, Any], timeout: Any) -> Dict:
+        async with self.breaker.call():
+            response = await http_client.post(
+                self.url,
+                headers=self.headers,
+                json={**payload, "model": self.model},
+                timeout=timeout
+            )
+            response.raise_for_status()
+            return json.loads(response.text)
+
+
+class LatencyWindow:
+    """最近 N 次主路由耗时，用于计算对冲阈值"""
+
+    def __init__(self, size: int):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> float:
+        """最近秩法百分位"""
+        ordered = sorted(self._samples)
+        rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+        return ordered[rank - 1]
+
+
+class DecisionRouter:
+    """
+    决策阶段（非流式）的模型路由：
+    - 对冲：主路由超过延迟阈值仍未返回时向备用路由并发一份，取先成功的结果；
+    - 故障转移：主路由失败（超时 / 5xx 等）时改用备用路由。
+    """
+
+    def __init__(self, primary: LLMRoute, backup: Optional[LLMRoute], timeout: Any):
+        self.primary = primary
+        self.backup = backup
+        self.timeout = timeout
+        self.latency = LatencyWindow(LLM_HEDGE_WINDOW)
+        # 最近窗口内每个请求是否触发了对冲
+        self._hedged: Deque[bool] = deque(maxlen=LLM_HEDGE_WINDOW)
+
+    def hedge_delay(self) -> Optional[float]:
+        """样本不足时返回 None（不对冲）"""
+        if len(self.latency) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        delay = self.latency.percentile(LLM_HEDGE_PERCENTILE)
+        return min(max(delay, LLM_HEDGE_MIN_DELAY), LLM_HEDGE_MAX_DELAY)
+
+    def _hedge_allowed(self) -> bool:
+        if not (LLM_HEDGE_ENABLED and self.backup):
+            return False
+        return sum(self._hedged) < LLM_HEDGE_MAX_RATIO * max(len(self._hedged), 1)
+
+    async def _timed(self, route: LLMRoute, http_client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict:
+        started = time.perf_counter()
+        rejected = False
+        try:
+            return await route.complete(http_client, payload, self.timeout)
+        except CircuitOpen:
+            # 熔断拒绝不是一次真实调用，不计入延迟
+            rejected = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if not rejected:
+                metrics.observe("llm_route_seconds", elapsed, {"route": route.name})
+            if route is self.primary and not rejected:
+                # 被对冲取消时记录已等待的时间（真实耗时的下界），避免窗口只保留快请求
+                self.latency.record(elapsed)
+
+    async def complete(self, http_client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict:
+        tasks: Dict[asyncio.Task, LLMRoute] = {
+            asyncio.create_task(self._timed(self.primary, http_client, payload)): self.primary
+        }
+        hedged = False
+        first_error: Optional[BaseException] = None
+        try:
+            delay = self.hedge_delay() if self._hedge_allowed() else None
+            wait_for = delay
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                wait_for = None
+                if not done:
+                    # 主路由超过对冲阈值：备用路由并发一份
+                    hedged = True
+                    metrics.inc("llm_hedges_total")
+                    logger.info("决策请求超过 %.2f 秒未返回，对冲到 %s", delay, self.backup.name)
+                    tasks[asyncio.create_task(self._timed(self.backup, http_client, payload))] = self.backup
+                    continue
+                for task in done:
+                    route = tasks.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        metrics.inc("llm_route_wins_total", labels={"route": route.name})
+                        return task.result()
+                    metrics.inc("llm_route_errors_total", labels={"route": route.name})
+                    first_error = first_error or error
+                    # 主路由失败且尚未对冲：立即转移到备用路由
+                    if route is self.primary and not hedged and self.backup and should_failover(error):
+                        hedged = True
+                        metrics.inc("llm_failovers_total")
+                        logger.warning("决策请求失败，转移到 %s：%s", self.backup.name, error)
+                        tasks[asyncio.create_task(self._timed(self.backup, http_client, payload))] = self.backup
+            raise first_error
+        finally:
+            self._hedged.append(hedged)
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        return {
+            "primary": f"{self.primary.model}@{self.primary.url}",
+            "backup": f"{self.backup.model}@{self.backup.url}" if self.backup else None,
+            "hedge_delay": round(delay, 3) if delay is not None else None,
+            "samples": len(self.latency),
+            "hedged_ratio": round(sum(self._hedged) / len(self._hedged), 3) if self._hedged else 0.0,
+        }
+
+
+def build_decision_router(primary: LLMRoute, timeout: Any) -> DecisionRouter:
+    """
+    备用路由未配置的项沿用主路由的值；端点与模型都与主路由相同时不设备用路由，
+    避免对冲 / 故障转移只是向同一个服务商重复发送付费请求。
+    """
+    url = LLM_BACKUP_URL or primary.url
+    model = MODEL_SECOND_PASS or primary.model
+    if url == primary.url and model == primary.model:
+        return DecisionRouter(primary, None, timeout)
+    headers = primary.headers
+    if LLM_BACKUP_API_KEY:
+        headers = {**primary.headers, "Authorization": f"Bearer {LLM_BACKUP_API_KEY}"}
+    # 独立的备用端点单独熔断；同一端点共用主熔断器
+    breaker = primary.breaker
+    if url != primary.url:
+        breaker = CircuitBreaker("llm_backup", "备用 LLM 服务", is_failure=should_failover)
+    backup = LLMRoute("backup", url, model, headers, breaker)
+    return DecisionRouter(primary, backup, timeout)
@@ -1,4 +1,4 @@
-import asyncio
+import logging
 import os
 import json
 from dotenv import load_dotenv
@@ -7,6 +7,12 @@ from fastmcp import Client
 from fastmcp.client.transports import SSETransport
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
+from http_client import get_http_client, DECISION_TIMEOUT, STREAM_TIMEOUT
+from pacing import pace
+from sse_decoder import iter_chat_deltas
+from app_logging import get_logger
+
+logger = get_logger(__name__)
 
 # ----------------------------------------------------
 # 配置 (Configuration)
@@ -72,7 +78,7 @@ def extract_tool_result(result):
             raw_text = result.content[0].text
             return json.loads(raw_text)
     except Exception as e:
-        print("Failed to parse tool result:", e)
+        logger.warning("Failed to parse tool result: %s", e)
     return str(result)  # Fallback
 
 async def function_calling_stream(messages, tools):
@@ -87,28 +93,16 @@ async def function_calling_stream(messages, tools):
         "stream": True  # Key: Enable streaming response
     }
 
-    # 使用全局客户端，它的默认超时为 60.0 秒，适合较长的流式响应
-    async with httpx.AsyncClient(timeout=60.0) as http:
-        async with http.stream("POST", LLM_API, headers=HEADERS, json=payload) as response:
-            response.raise_for_status()
-            async for chunk in response.aiter_text():
-                if not chunk.strip():
-                    continue
-                # Parse SSE format chunk (OpenAI streaming response is JSON fragments)
-                for line in chunk.splitlines():
-                    line = line.strip()
-                    if line.startswith("data: "):
-                        data = line[6:]  # Remove "data: " prefix
-                        if data == "[DONE]":
-                            return
-                        try:
-                            json_data = json.loads(data)
-                            # Extract content fragment (Markdown format)
-                            content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                            if content:
-                                yield content  # Stream out each fragment
-                        except json.JSONDecodeError:
-                            continue
+    # 使用应用级共享客户端，流式阶段使用 STREAM_TIMEOUT
+    http = get_http_client()
+    async with http.stream("POST", LLM_API, headers=HEADERS, json=payload, timeout=STREAM_TIMEOUT) as response:
+        response.raise_for_status()
+        # Incremental SSE decoding over raw bytes (partial lines are buffered, not dropped)
+        async for delta in iter_chat_deltas(response.aiter_bytes()):
+            # Extract content fragment (Markdown format)
+            content = delta.get("content")
+            if content:
+                yield content  # Stream out each fragment
 
 # ----------------------------------------------------
 # Core Logic Function (Asynchronous Generator)
@@ -123,10 +117,11 @@ async def mcp_main(question: str = ''):
         return
 
     transport = SSETransport(SSE_URL)
-    print(f"Using SSE Transport URL: {SSE_URL}")
+    logger.debug("Using SSE Transport URL: %s", SSE_URL)
 
-    # 客户端超时设置为 60.0 秒，但第一次 POST 请求会使用更短的 FIRST_PASS_TIMEOUT
-    async with Client(transport) as client, httpx.AsyncClient(timeout=60.0) as http:
+    # 共享客户端默认使用流式超时，第一次 POST 请求会使用更短的 DECISION_TIMEOUT
+    http = get_http_client()
+    async with Client(transport) as client:
         try:
             # 1. Tool discovery
             # yield "data: ### 🚀 初始化工具环境...\n\n\n" # Yield header in SSE format
@@ -147,7 +142,6 @@ async def mcp_main(question: str = ''):
             
             # Yield discovery message in SSE format
             # yield f"data: ✅ 发现 {len(tools)} 个可用工具。开始 LLM 决策 ({FIRST_PASS_TIMEOUT}s 超时)....\n\n\n"
-            await asyncio.sleep(0.5)
 
             # 2. First LLM call: Decision making (non-streaming)
             messages = [{"role":"system","content": PROMPT},{"role": "user", "content": question}]
@@ -164,11 +158,11 @@ async def mcp_main(question: str = ''):
                 LLM_API, 
                 headers=HEADERS, 
                 json=payload,
-                timeout=FIRST_PASS_TIMEOUT 
+                timeout=DECISION_TIMEOUT 
             )
-            print(f"LLM 第一次请求状态码 : {response.status_code}")
+            logger.debug("LLM 第一次请求状态码 : %s", response.status_code)
             if response.status_code >= 400:
-                print(f"LLM 第一次请求错误响应 (First LLM request error response): {response.text}")
+                logger.warning("LLM 第一次请求错误响应 (First LLM request error response): %s", response.text[:500])
             
             response.raise_for_status()
             
@@ -178,42 +172,33 @@ async def mcp_main(question: str = ''):
                 # 尝试 JSON 解码
                 data = json.loads(response_text)
             except json.JSONDecodeError as e:
-                # 捕获 JSON 解码错误，并打印原始响应文本
-                print("!!! JSON DECODE ERROR (Status 200) !!!")
-                print(f"错误类型: {type(e).__name__}, 消息: {str(e)}")
-                print("原始响应文本:")
-                raw_text = response_text
-                print(raw_text[:500] + "..." if len(raw_text) > 500 else raw_text)
+                # 捕获 JSON 解码错误，并记录原始响应文本（截断）
+                logger.error("LLM 响应 JSON 解码失败: %s: %s", type(e).__name__, e,
+                             extra={"fields": {"raw": response_text[:500]}})
                 # 重新抛出异常，由外部 handler 处理
                 raise e 
 
             try:
                 choice = data["choices"][0]
                 assistant_message = choice["message"]
-                print(f"LLM 回复内容: {assistant_message}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("LLM 回复内容: %s", assistant_message)
                 tool_calls = assistant_message.get("tool_calls")
             except (IndexError, KeyError) as e:
-                # 捕获结构访问错误，并打印接收到的 JSON 数据
-                print("==============================================")
-                print("!!! UNEXPECTED JSON STRUCTURE (Status 200) !!!")
-                print(f"错误类型: {type(e).__name__}, 消息: {str(e)}")
-                print("JSON DATA (请检查 'choices' 或 'message' 键/索引):")
-                print(json.dumps(data, indent=2, ensure_ascii=False))
-                print("==============================================")
+                # 捕获结构访问错误，并记录接收到的 JSON 数据（截断）
+                logger.error("LLM 响应结构异常 (请检查 'choices' 或 'message' 键/索引): %s: %s", type(e).__name__, e,
+                             extra={"fields": {"raw": response_text[:500]}})
                 # 重新抛出异常
                 raise e
 
             # 3. If LLM replies directly (no tool call)
             if not tool_calls:
                 direct_response = assistant_message.get("content", "未能获取 LLM 回复")
-                await asyncio.sleep(0.05) # Yield header first
                 # Stream the direct response line by line, enforced SSE format
                 for line in direct_response.split('\n'):
                     if line:
                         yield f"data: {line}\n\n"
-                        await asyncio.sleep(0.1) # Simulate noticeable flow
                 return 
-            await asyncio.sleep(0.5)
 
             # Add tool call request to message history
             messages.append(assistant_message)
@@ -225,14 +210,12 @@ async def mcp_main(question: str = ''):
                     arguments = json.loads(call["function"]["arguments"])
                 except json.JSONDecodeError:
                     error_msg = f"❌ 工具调用参数解析错误：{call['function']['arguments']}\n\n"
-                    print(error_msg)
+                    logger.warning(error_msg.strip())
                     yield f"data: {error_msg}\n\n" # Yield error in SSE format
                     continue
-                await asyncio.sleep(0.3)
                 # Call MCP tool
                 result = await client.call_tool(tool_name, arguments)
                 tool_result_content = extract_tool_result(result)
-                await asyncio.sleep(0.5)
                 # Add tool result to message history
                 messages.append({
                     "role": "tool",
@@ -240,19 +223,18 @@ async def mcp_main(question: str = ''):
                     "content": json.dumps(tool_result_content, ensure_ascii=False)
                 })
 
-            async for chunk in function_calling_stream(messages, tools):
+            async for chunk in pace(function_calling_stream(messages, tools)):
                 yield f"data: {chunk}\n\n"
-                # await asyncio.sleep(0.02)  # Control streaming speed
 
         except httpx.TimeoutException:
             # 专门捕获超时错误
             error_msg = f" ❌ 处理失败 - 超时连接 LLM API ({LLM_API}) 超时，已超过 {FIRST_PASS_TIMEOUT} 秒。\n"
-            print(error_msg)
+            logger.warning(error_msg.strip())
             error_msg += "请检查网络连接、API 密钥额度或尝试增加 `FIRST_PASS_TIMEOUT`。\n"
             yield f"data: {error_msg}\n\n"
         except Exception as e:
             # 捕获其他所有异常
             error_msg = f" ❌ 处理失败 - 发生意外错误：`{type(e).__name__}: {str(e)}`\n"
-            print(error_msg)
+            logger.exception(error_msg.strip())
             yield f"data: {error_msg}\n\n"
             
\ No newline at end of file
@@ -1,17 +1,31 @@
 import asyncio
 import os
 import json
-from typing import Optional, Dict, List, Any,AsyncGenerator  
+import time
+from typing import Optional, Dict, List, Any, AsyncGenerator, Tuple
 from dotenv import load_dotenv
 import httpx
-from fastmcp import Client
-from fastmcp.client.transports import SSETransport
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from datetime import datetime
 from base64 import b64encode
 import hmac
 import hashlib
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
+from mcp_pool import get_mcp_pool, mcp_breaker, MCPPoolBusy
+from tool_catalog import tool_catalog
+from http_client import get_http_client, DECISION_TIMEOUT, STREAM_TIMEOUT
+from pacing import pace
+from schema_cache import schema_cache, ToolFetcher
+from result_cache import result_cache, QUERY_TOOL
+from result_compaction import compact_result, fit_token_budget
+from sse_decoder import iter_chat_deltas
+from llm_router import LLMRoute, build_decision_router, llm_breaker
+from circuit_breaker import CircuitOpen
+import metrics
+from app_logging import get_logger
+
+logger = get_logger(__name__)
 # ----------------------------------------------------
 # 配置 (Configuration)
 # ----------------------------------------------------
@@ -58,12 +72,21 @@ APP_SECRET = os.getenv("APP_SECRET", "F8C1FFF55A1B450999E23DC474D24226")
 WS_BASE_URL = os.getenv("WS_BASE_URL", "http://10.196.91.30:30000")
 ASSISTANT_CODE = os.getenv("ASSISTANT_CODE", "scene@1971108944157155328")
 CHAT_ENDPOINT = os.getenv("CHAT_ENDPOINT", "/openapi/flames/api/v1/chat")
+# 同一轮内并发执行的工具调用上限，以及单个工具调用的超时时间
+TOOL_FANOUT_LIMIT = int(os.getenv('TOOL_FANOUT_LIMIT', 4))
+TOOL_CALL_TIMEOUT = float(os.getenv('TOOL_CALL_TIMEOUT', 30.0))
+# 多轮工具调用：最大步数与整个问题的总时限（秒）
+AGENT_MAX_STEPS = int(os.getenv('AGENT_MAX_STEPS', 5))
+AGENT_DEADLINE = float(os.getenv('AGENT_DEADLINE', 120.0))
 # 请求头信息
 HEADERS = {
     "Authorization": f"Bearer {API_KEY}",
     "Content-Type": "application/json"
 }
 
+# 决策阶段的模型路由：延迟超过阈值时对冲、主路由失败时转移到 MODEL_SECOND_PASS / 备用端点
+decision_router = build_decision_router(LLMRoute("primary", LLM_API, MODEL, HEADERS), DECISION_TIMEOUT)
+
 # ----------------------------------------------------
 # FastAPI 应用初始化
 # ----------------------------------------------------
@@ -82,13 +105,113 @@ def extract_tool_result(result: Any) -> Dict[str, Any]:
             raw_text = result.content[0].text
             return json.loads(raw_text)
     except Exception as e:
-        print(f"解析工具结果失败: {str(e)}")
+        logger.warning("解析工具结果失败: %s", e)
     return {"error": "解析工具结果失败", "raw_result": str(result)}
 
+def sse_progress(text: str) -> str:
+    """中间进度事件；只读取 data 行的客户端会把它当作普通文本展示"""
+    return f"event: progress\ndata: {text}\n\n"
+
+def tool_message(call: Dict, content: Any) -> Dict[str, Any]:
+    """构造写回消息历史的 tool 消息"""
+    return {
+        "role": "tool",
+        "tool_call_id": call["id"],
+        "content": json.dumps(content, ensure_ascii=False)
+    }
+
+async def run_tool_call(
+    call: Dict,
+    semaphore: asyncio.Semaphore,
+    fetch: ToolFetcher,
+    use_cache: bool = True
+) -> Tuple[Dict, Optional[str]]:
+    """执行单个工具调用，返回 (tool 消息, 错误信息)；单个调用失败或超时不影响其他调用"""
+    tool_name = call["function"]["name"]
+    try:
+        arguments = json.loads(call["function"]["arguments"] or "{}")
+    except json.JSONDecodeError:
+        error_msg = f"工具调用参数解析错误: {call['function']['arguments']}"
+        return tool_message(call, {"error": error_msg}), error_msg
+
+    # 表清单 / 表结构优先由本地结构缓存应答
+    cached = schema_cache.lookup(tool_name, arguments)
+    if cached is not None:
+        return tool_message(call, cached), None
+
+    # 只读查询结果缓存：键为 (目标库, 归一化 SQL)
+    cache_key = None
+    if use_cache and tool_name == QUERY_TOOL:
+        cache_key = result_cache.key(schema_cache.target, arguments)
+        cached = result_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return tool_message(call, compact_result(cached)), None
+
+    try:
+        async with semaphore:
+            with metrics.span("call_tool", tool=tool_name):
+                tool_result = await fetch(tool_name, arguments)
+        schema_cache.store(tool_name, arguments, tool_result)
+        if cache_key:
+            result_cache.put(cache_key, tool_result)
+        # 大结果集压缩为列式摘要后再写回消息历史（缓存中保留完整结果）
+        if tool_name == QUERY_TOOL:
+            tool_result = compact_result(tool_result)
+        return tool_message(call, tool_result), None
+    except asyncio.CancelledError:
+        # 客户端断开导致的取消，向上传播
+        metrics.inc("tool_calls_cancelled_total")
+        raise
+    except asyncio.TimeoutError:
+        metrics.inc("tool_timeouts_total", labels={"tool": tool_name})
+        error_msg = f"调用工具 {tool_name} 超时，超过 {TOOL_CALL_TIMEOUT} 秒"
+    except Exception as e:
+        metrics.inc("tool_errors_total", labels={"tool": tool_name})
+        error_msg = f"调用工具 {tool_name} 失败: {str(e)}"
+    return tool_message(call, {"error": error_msg}), error_msg
+
+async def execute_tool_calls(
+    tool_calls: List[Dict],
+    use_cache: bool = True
+) -> List[Tuple[Dict, Optional[str]]]:
+    """
+    以 TOOL_FANOUT_LIMIT 为并发上限执行一轮中的全部工具调用，结果顺序与 tool_calls 一致。
+    整轮只借用一个 MCP 会话，并发调用在该会话上复用（避免单个问题占满会话池）；
+    全部命中缓存时不借用会话，LLM 阶段也不占用会话。
+    """
+    semaphore = asyncio.Semaphore(TOOL_FANOUT_LIMIT)
+    lock = asyncio.Lock()
+    session_fetch: Optional[ToolFetcher] = None
+    session_error: Optional[Exception] = None
+    async with AsyncExitStack() as stack:
+        async def fetch(tool_name: str, arguments: Dict[str, Any]) -> Any:
+            nonlocal session_fetch, session_error
+            async with lock:
+                # 借用失败（熔断 / 会话池繁忙）时本轮其余调用直接复用该错误，不再逐个等待
+                if session_error is not None:
+                    raise session_error
+                if session_fetch is None:
+                    try:
+                        session_fetch = await stack.enter_async_context(tool_session())
+                    except Exception as e:
+                        session_error = e
+                        raise
+            return await session_fetch(tool_name, arguments)
+        return await asyncio.gather(*(run_tool_call(call, semaphore, fetch, use_cache) for call in tool_calls))
+
+@asynccontextmanager
+async def tool_session():
+    """借用一个 MCP 会话，产出在该会话上直接调用工具的 fetch（一轮工具调用 / 缓存预热整轮只占一个会话）"""
+    async with get_mcp_pool().acquire() as mcp_client:
+        async def fetch(tool_name: str, arguments: Dict[str, Any]) -> Any:
+            async with mcp_breaker.call():
+                result = await asyncio.wait_for(mcp_client.call_tool(tool_name, arguments), timeout=TOOL_CALL_TIMEOUT)
+            return extract_tool_result(result)
+        yield fetch
+
 async def get_llm_first_response(http_client: httpx.AsyncClient, messages: List[Dict], tools: List[Dict]) -> Dict:
     """获取LLM的第一次响应（决策阶段）"""
     payload = {
-        "model": MODEL,
         "messages": messages,
         "tools": tools,
         "tool_choice": "auto",
@@ -96,151 +219,194 @@ async def get_llm_first_response(http_client: httpx.AsyncClient, messages: List[
     }
     
     try:
-        response = await http_client.post(
-            LLM_API,
-            headers=HEADERS,
-            json=payload,
-            timeout=FIRST_PASS_TIMEOUT
-        )
-        response.raise_for_status()
-        return json.loads(response.text)
+        # 模型由路由决定：主路由慢时对冲、失败时转移到备用路由
+        with metrics.span("llm_decision"):
+            return await decision_router.complete(http_client, payload)
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except httpx.TimeoutException:
+        metrics.inc("llm_timeouts_total", labels={"pass": "decision"})
         raise HTTPException(status_code=504, detail=f"LLM API 超时，超过 {FIRST_PASS_TIMEOUT} 秒")
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"LLM API 请求失败: {str(e)}")
     except json.JSONDecodeError as e:
         raise HTTPException(status_code=500, detail=f"解析LLM响应失败: {str(e)}")
 
-async def stream_llm_response(http_client: httpx.AsyncClient, messages: List[Dict], tools: List[Dict]):
-    """流式获取LLM的最终响应"""
+def merge_tool_call_deltas(tool_calls: List[Dict], deltas: List[Dict]) -> None:
+    """把流式响应中分片到达的 tool_calls 按 index 拼接成完整的调用"""
+    for delta in deltas:
+        index = delta.get("index", len(tool_calls))
+        while len(tool_calls) <= index:
+            tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+        call = tool_calls[index]
+        if delta.get("id"):
+            call["id"] = delta["id"]
+        function = delta.get("function") or {}
+        if function.get("name"):
+            call["function"]["name"] += function["name"]
+        if function.get("arguments"):
+            call["function"]["arguments"] += function["arguments"]
+
+async def stream_llm_response(
+    http_client: httpx.AsyncClient,
+    messages: List[Dict],
+    tools: List[Dict],
+    tool_calls_out: Optional[List[Dict]] = None,
+    tool_choice: str = "auto"
+):
+    """流式获取LLM的响应；传入 tool_calls_out 时收集模型在流中发起的工具调用"""
     payload = {
         "model": MODEL,
         "messages": messages,
         "tools": tools,
-        "tool_choice": "auto",
+        "tool_choice": tool_choice,
         "stream": True
     }
 
+    started = time.perf_counter()
+    first_token = True
     try:
-        async with http_client.stream(
-            "POST", 
-            LLM_API, 
-            headers=HEADERS, 
-            json=payload
-        ) as response:
-            response.raise_for_status()
-            async for chunk in response.aiter_text():
-                if not chunk.strip():
-                    continue
-                for line in chunk.splitlines():
-                    line = line.strip()
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            return
-                        try:
-                            json_data = json.loads(data)
-                            content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                            if content:
-                                yield content
-                        except json.JSONDecodeError:
-                            continue
+        # 整个流的耗时（含下游消费时间）计入 llm_stream 阶段
+        with metrics.span("llm_stream"):
+            # 熔断结果在收到首个增量时确定；之后的耗时与中途断开不计入 LLM 故障
+            async with llm_breaker.call() as attempt, http_client.stream(
+                "POST", 
+                LLM_API, 
+                headers=HEADERS, 
+                json=payload,
+                timeout=STREAM_TIMEOUT
+            ) as response:
+                response.raise_for_status()
+                # 增量 SSE 解码：跨网络分块的半行会被缓冲而不是丢弃
+                async for delta in iter_chat_deltas(response.aiter_bytes()):
+                    attempt.settle()
+                    if tool_calls_out is not None and delta.get("tool_calls"):
+                        merge_tool_call_deltas(tool_calls_out, delta["tool_calls"])
+                    content = delta.get("content")
+                    if content:
+                        if first_token:
+                            first_token = False
+                            metrics.observe("llm_ttft_seconds", time.perf_counter() - started)
+                        yield content
+    except asyncio.CancelledError:
+        metrics.inc("llm_streams_cancelled_total")
+        raise
+    except CircuitOpen as e:
+        yield f"❌ {e}"
     except httpx.HTTPError as e:
+        if isinstance(e, httpx.TimeoutException):
+            metrics.inc("llm_timeouts_total", labels={"pass": "stream"})
         yield f"❌ LLM 流式响应失败: {str(e)}"
 
 # ----------------------------------------------------
 # 核心逻辑
 # ----------------------------------------------------                                          
-async def mcp_main(question: str) -> AsyncGenerator[str, Any]:
-    """处理用户查询的异步生成器"""
+async def mcp_main(question: str, use_cache: bool = True) -> AsyncGenerator[str, Any]:
+    """处理用户查询的异步生成器；use_cache=False 时跳过查询结果缓存"""
+    started = time.perf_counter()
     if not API_KEY:
         yield "data: {\"error\": \"OAI_API_KEY 环境变量未设置\"}\n\n"
         return
 
-    # 初始化客户端
-    transport = SSETransport(SSE_URL)
-
     try:
-        async with Client(transport) as mcp_client, httpx.AsyncClient(timeout=60.0) as http_client:
-            # 1. 工具发现
-            await mcp_client.ping()
-            tool_defs = await mcp_client.list_tools()
-            
-            # 转换工具定义为LLM可识别的格式
-            tools = []
-            for tool in tool_defs:
-                tools.append({
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": tool.inputSchema
-                    }
-                })
-            
-            # 2. 第一次LLM调用：决策阶段
-            messages = [
-                {"role": "system", "content": PROMPT},
-                {"role": "user", "content": question}
-            ]
-            
-            try:
-                llm_response = await get_llm_first_response(http_client, messages, tools)
-            except HTTPException as e:
-                yield f"data: ❌ {e.detail}\n\n"
-                return
+        # MCP 会话只在 list_tools / call_tool 期间从会话池借用，健康检查由连接池负责
+        # LLM 请求复用应用级共享的 HTTP 连接池
+        http_client = get_http_client()
+        # 1. 工具发现（走目录缓存，已转换为LLM可识别的格式）
+        tools = await tool_catalog.get(get_mcp_pool())
+        
+        # 2. 第一次LLM调用：决策阶段
+        messages = [
+            {"role": "system", "content": PROMPT},
+            {"role": "user", "content": question}
+        ]
+        
+        try:
+            llm_response = await get_llm_first_response(http_client, messages, tools)
+        except HTTPException as e:
+            yield f"data: ❌ {e.detail}\n\n"
+            return
 
-            # 解析LLM响应
-            try:
-                choice = llm_response["choices"][0]
-                assistant_message = choice["message"]
-                tool_calls = assistant_message.get("tool_calls", [])
-            except (IndexError, KeyError) as e:
-                error_msg = f"❌ 解析LLM响应结构失败: {str(e)}\n响应内容: {json.dumps(llm_response, ensure_ascii=False)}"
-                yield f"data: {error_msg}\n\n"
-                return
+        # 解析LLM响应
+        try:
+            choice = llm_response["choices"][0]
+            assistant_message = choice["message"]
+            tool_calls = assistant_message.get("tool_calls", [])
+        except (IndexError, KeyError) as e:
+            error_msg = f"❌ 解析LLM响应结构失败: {str(e)}\n响应内容: {json.dumps(llm_response, ensure_ascii=False)}"
+            yield f"data: {error_msg}\n\n"
+            return
 
-            # 3. 如果LLM直接回复（无需工具调用）
-            if not tool_calls:
-                direct_response = assistant_message.get("content", "未能获取LLM回复")
-                for line in direct_response.split('\n'):
-                    if line:
-                        yield f"data: {line}\n\n"
-                        await asyncio.sleep(0.1)
-                return
+        # 3. 如果LLM直接回复（无需工具调用）
+        if not tool_calls:
+            direct_response = assistant_message.get("content", "未能获取LLM回复")
+            metrics.observe("answer_ttft_seconds", time.perf_counter() - started)
+            for line in direct_response.split('\n'):
+                if line:
+                    yield f"data: {line}\n\n"
+            return
 
-            # 4. 执行工具调用
+        # 4. 多轮工具调用：每步执行完工具后流式请求LLM，模型可继续调用工具或直接给出最终答案
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + AGENT_DEADLINE
+        step = 0
+        answered = False
+        timeout_msg = f"data: ❌ 处理超时，超过总时限 {AGENT_DEADLINE} 秒\n\n"
+        while tool_calls:
+            if step >= AGENT_MAX_STEPS:
+                # 以错误帧结束，避免被截断的回答写入答案缓存
+                yield f"data: ❌ 已达到最大工具调用步数 {AGENT_MAX_STEPS}，回答可能不完整\n\n"
+                return
+            step += 1
             messages.append(assistant_message)  # 将工具调用请求添加到消息历史
-            
             for call in tool_calls:
-                tool_name = call["function"]["name"]
-                try:
-                    arguments = json.loads(call["function"]["arguments"])
-                except json.JSONDecodeError:
-                    error_msg = f"❌ 工具调用参数解析错误: {call['function']['arguments']}"
-                    yield f"data: {error_msg}\n\n"
-                    continue
+                yield sse_progress(f"🔧 第 {step} 步：调用工具 {call['function']['name']}")
 
-                # 调用MCP工具
-                try:
-                    result = await mcp_client.call_tool(tool_name, arguments)
-                    tool_result = extract_tool_result(result)
-                    # 将工具结果添加到消息历史
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": call["id"],
-                        "content": json.dumps(tool_result, ensure_ascii=False)
-                    })
-                except Exception as e:
-                    error_msg = f"❌ 调用工具 {tool_name} 失败: {str(e)}"
-                    yield f"data: {error_msg}\n\n"
-                    continue
+            # 并发执行相互独立的工具调用，结果按 tool_call_id 原始顺序写回；超过剩余时限时整体取消
+            try:
+                async with asyncio.timeout_at(deadline):
+                    results = await execute_tool_calls(tool_calls, use_cache)
+            except TimeoutError:
+                yield timeout_msg
+                return
+            for result_message, error_msg in results:
+                messages.append(result_message)
+                if error_msg:
+                    yield f"data: ❌ {error_msg}\n\n"
 
-            # 5. 流式返回最终结果
-            async for chunk in stream_llm_response(http_client, messages, tools):
-                yield f"data: {chunk}\n\n"
-                await asyncio.sleep(0.02)
+            # 5. 流式返回本步结果；最后一步不再允许调用工具，要求模型基于已有结果作答
+            tool_calls = []
+            content_parts = []
+            tool_choice = "auto" if step < AGENT_MAX_STEPS else "none"
+            if fit_token_budget(messages):
+                yield sse_progress("✂️ 工具结果过大，已截断以控制在 token 预算内")
+            stream = pace(stream_llm_response(http_client, messages, tools, tool_calls, tool_choice))
+            async with aclosing(stream):
+                while True:
+                    # 时限只作用于等待上游的下一块，不覆盖 yield 给下游的时间
+                    try:
+                        async with asyncio.timeout_at(deadline):
+                            chunk = await anext(stream)
+                    except StopAsyncIteration:
+                        break
+                    except TimeoutError:
+                        yield timeout_msg
+                        return
+                    if not answered:
+                        # 用户看到的首个回答内容（不含进度事件）
+                        answered = True
+                        metrics.observe("answer_ttft_seconds", time.perf_counter() - started)
+                    content_parts.append(chunk)
+                    yield f"data: {chunk}\n\n"
+            assistant_message = {
+                "role": "assistant",
+                "content": "".join(content_parts) or None,
+                "tool_calls": tool_calls
+            }
 
+    except (CircuitOpen, MCPPoolBusy) as e:
+        # 依赖在请求中途熔断 / 会话池等待超时：直接返回错误帧
+        yield f"data: ❌ {e}\n\n"
     except Exception as e:
         error_msg = f"❌ 处理查询时发生意外错误: {str(e)}"
         yield f"data: {error_msg}\n\n"
@@ -1,137 +1,62 @@
 # app.py
 import os
-import json
-from datetime import datetime, timedelta
-from typing import Optional
-import asyncio
 import os
-import json
 from dotenv import load_dotenv
 import httpx
 from fastmcp import Client
 from fastmcp.client.transports import SSETransport
 from fastapi import FastAPI
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends, Header, Form,WebSocket, WebSocketDisconnect,Query
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, Form,WebSocket,Query, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from user import UserCreate, TokenResponse # 导入 user 模块以获取 UserCreate 和 TokenResponse
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi.middleware.cors import CORSMiddleware
-from llmapi4 import mcp_main   ,create_ai_ws_url
-# SQLAlchemy (同步) 简单版
-from sqlalchemy import Column, Integer, String, Boolean, create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
-import websockets 
+from llmapi4 import mcp_main, tool_session, decision_router
+from llm_router import llm_breaker
+from mcp_pool import mcp_breaker
+from circuit_breaker import open_breaker, fail_fast_sse, breaker_states
+import mcp_pool
+from tool_catalog import tool_catalog, CatalogMessageHandler
+from http_client import get_http_client, close_http_client
+from schema_cache import schema_cache
+from result_cache import result_cache
+from answer_cache import answer_cache, cached_answer, cached_sse, replay_sse
+from cancellation import cancel_on_disconnect
+from ws_relay import ai_question_session, receive_auth_token, upstream_pool
+from admission import admission, admitted_sse
+from ratelimit import rate_limiter, charged_sse, estimate_question_tokens
+import metrics
+from password_hashing import password_hasher
+from user_cache import user_cache, token_cache
+# 统一的认证子系统：单一 engine / User 模型 / token 格式
+import auth
+from auth import get_current_active_user, create_access_token, authenticate, register_user, JWT_EXPIRE_MINUTES
+from crud import migrate_schema, init_db
+from deps import engine, async_db
+from models import User
+from app_logging import setup_logging, shutdown_logging, get_logger, set_correlation_id
 import uuid
 load_dotenv()
+setup_logging()
+logger = get_logger(__name__)
 
 # LLM / MCP related envs (保留你原来的)
 MODEL = os.getenv("MODEL", "Qwen/Qwen3-14B")
-MODEL_SECOND_PASS = os.getenv("MODEL_SECOND_PASS", MODEL)
 API_KEY = os.getenv('OAI_API_KEY')
 SSE_URL = os.getenv('SSE_URL', 'http://localhost:19068/sse')
 LLM_API = os.getenv('BASE_URL', "https://api.siliconflow.cn/v1/chat/completions")
 FIRST_PASS_TIMEOUT = float(os.getenv('FIRST_PASS_TIMEOUT', 10.0))
 APP_ID = os.getenv("APP_ID", "0FCBBC4DB13541E8AE20")
 ASSISTANT_CODE = os.getenv("ASSISTANT_CODE", "scene@1971108944157155328")
-# JWT config
-JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "super-secret-key")
-JWT_ALGORITHM = "HS256"
-JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", 60))
-
-# SQLite DB path
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./users.db")
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL, connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# 初始管理员：两项都显式设置时才会创建，没有默认密码
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 # Header Information
 HEADERS = {
     "Authorization": f"Bearer {API_KEY}",
     "Content-Type": "application/json"
 }
 # ------------------------------
-# Password hashing
-# ------------------------------
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# ------------------------------
-# SQLAlchemy setup
-# ------------------------------
-Base = declarative_base()
-
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(150), unique=True, index=True, nullable=False)
-    hashed_password = Column(String(300), nullable=False)
-    is_active = Column(Boolean, default=True)
-
-# Create tables at startup
-def create_db_and_tables():
-    Base.metadata.create_all(bind=engine)
-
- 
-# ------------------------------
-# JWT helpers
-# ------------------------------
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=JWT_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
-    return encoded_jwt
-
-def verify_jwt_token(token: str) -> str:
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid JWT: missing subject")
-        return username
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail=f"Invalid or expired token: {str(e)}")
-
-# ------------------------------
-# DB utility
-# ------------------------------
-def get_db() -> Session:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def get_user_by_username(db: Session, username: str) -> Optional[User]:
-    return db.query(User).filter(User.username == username).first()
-
-def create_user(db: Session, username: str, password: str) -> User:
-    hashed = pwd_context.hash(password)
-    db_user = User(username=username, hashed_password=hashed, is_active=True)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-#提取工具调用结果
-def extract_tool_result(result):
-    """Attempt to extract JSON content from fastmcp ClientCallResult"""
-    try:
-        if result.content:
-            raw_text = result.content[0].text
-            return json.loads(raw_text)
-    except Exception as e:
-        print("Failed to parse tool result:", e)
-    return str(result)  # Fallback
-# ------------------------------
 # FastAPI 初始化
 # ------------------------------
 app = FastAPI(title="Streaming DB Inspector (JWT + SQLite Users)")
@@ -142,41 +67,89 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-# 建表
+# 认证路由（/api/auth/token、/api/auth/me、/api/auth/admin/*）
+app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
+
+# 建表 + 补齐新增列；配置了 ADMIN_USERNAME / ADMIN_PASSWORD 时初始化管理员
 @app.on_event("startup")
 def on_startup():
-    create_db_and_tables()
+    migrate_schema(engine)
+    if ADMIN_USERNAME and ADMIN_PASSWORD:
+        init_db(engine, ADMIN_USERNAME, ADMIN_PASSWORD)
+
+# MCP 会话池：应用生命周期内复用 SSE 会话
+@app.on_event("startup")
+async def start_mcp_pool():
+    mcp_pool.mcp_pool = mcp_pool.MCPSessionPool(message_handler=CatalogMessageHandler(tool_catalog))
+    await mcp_pool.mcp_pool.start()
+
+@app.on_event("shutdown")
+async def close_mcp_pool():
+    if mcp_pool.mcp_pool is not None:
+        await mcp_pool.mcp_pool.close()
+
+# LLM 共享 HTTP 客户端：keep-alive / HTTP2 连接池
+@app.on_event("startup")
+async def start_http_client():
+    get_http_client()
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await close_http_client()
+
+# 数据库结构缓存：启动预热 + 后台定期刷新
+@app.on_event("startup")
+async def start_schema_cache():
+    schema_cache.start(tool_session)
+
+@app.on_event("shutdown")
+async def stop_schema_cache():
+    await schema_cache.stop()
+
+@app.on_event("shutdown")
+async def close_upstream_pool():
+    await upstream_pool.close()
+
+# bcrypt 专用进程池：启动时创建
+@app.on_event("startup")
+def start_password_hasher():
+    password_hasher.start()
+
+@app.on_event("shutdown")
+def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def dispose_async_db():
+    await async_db.dispose()
+
+# 最后停止日志线程，写出队列中剩余的日志
+@app.on_event("shutdown")
+def stop_logging():
+    shutdown_logging()
 
 # ------------------------------
-# Auth Dependency
+# 限流依赖
 # ------------------------------
-async def get_current_active_user(authorization: str = Header(None)):
+async def rate_limited_user(request: Request, response: Response, user: User = Depends(get_current_active_user)):
     """
-    从 Authorization: Bearer <token> 中解析并验证 JWT，
-    并返回用户名（subject）。如果需要，可以查询 DB 检查用户仍存在/激活。
+    在鉴权之后按用户扣减请求令牌桶，剩余额度写入 X-RateLimit-* 响应头；
+    额度耗尽返回 429 并带上 Retry-After。
     """
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization header")
-    parts = authorization.split()
-    if len(parts) != 2 or parts[0].lower() != "bearer":
-        raise HTTPException(status_code=401, detail="Invalid Authorization header format")
-    token = parts[1]
-    username = verify_jwt_token(token)
-    # 可选：检查用户在 DB 中是否仍存在并激活
-    db = SessionLocal()
-    try:
-        user = get_user_by_username(db, username)
-        if not user or not user.is_active:
-            raise HTTPException(status_code=401, detail="用户不存在或已禁用")
-        return user
-    finally:
-        db.close()
+    result = await rate_limiter.check_request(user.username)
+    headers = result.headers()
+    if not result.allowed:
+        raise HTTPException(status_code=429, detail="请求过于频繁，请稍后重试", headers=headers)
+    response.headers.update(headers)
+    # StreamingResponse 不会合并依赖注入的 response 头，这里留给接口自行带上
+    request.state.rate_limit_headers = headers
+    return user
 
 # ------------------------------
 # Auth routes: register / login
 # ------------------------------
 @app.post("/register", status_code=201)
-def register(payload: UserCreate, db: Session = Depends(get_db)):
+async def register(payload: UserCreate):
     """
     注册新用户（简单实现）。生产请添加邮箱验证、复杂密码策略等。
     """
@@ -184,23 +157,18 @@ def register(payload: UserCreate, db: Session = Depends(get_db)):
     password = payload.password
     if not username or not password:
         raise HTTPException(status_code=400, detail="username and password required")
-    existing = get_user_by_username(db, username)
-    if existing:
-        raise HTTPException(status_code=400, detail="Username already registered")
-    user = create_user(db, username, password)
+    user = await register_user(username, password)
     return {"id": user.id, "username": user.username}
 
 @app.post("/api/login", response_model=TokenResponse)
-def login(username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+async def login(username: str = Form(...), password: str = Form(...)):
     """
-    登录并返回 JWT。
+    登录并返回 JWT。成本因子变化时顺带用新参数重新计算并保存密码哈希。
     """
-    user = get_user_by_username(db, username)
-    print("Login attempt for user:", user )
+    user = await authenticate(username, password)
+    logger.info("Login attempt", extra={"fields": {"username": username, "ok": user is not None}})
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
-    if not verify_password(password, user.hashed_password):
-        raise HTTPException(status_code=401, detail="Invalid username or password")
     access_token = create_access_token({"sub": user.username})
     return TokenResponse(access_token=access_token, expires_in=JWT_EXPIRE_MINUTES * 60)
 
@@ -208,28 +176,101 @@ def login(username: str = Form(...), password: str = Form(...), db: Session = De
 # Protected ping
 # ------------------------------
 @app.get("/ping")
-def ping(user: User = Depends(get_current_active_user)):
+def ping(user: User = Depends(rate_limited_user)):
     return {"status": "ok", "user": user.username}
 
+# ------------------------------
+# 健康检查：各外部依赖的熔断器状态（依赖故障不影响本服务存活，始终返回 200）
+# ------------------------------
+@app.get("/health")
+def health():
+    breakers = breaker_states()
+    degraded = any(b["state"] not in ("closed", "disabled") for b in breakers.values())
+    return {"status": "degraded" if degraded else "ok", "breakers": breakers}
+
+# ------------------------------
+# MCP 工具目录缓存：手动刷新
+# ------------------------------
+@app.post("/api/tools/refresh")
+async def refresh_tool_catalog(user: User = Depends(rate_limited_user)):
+    try:
+        async with mcp_pool.get_mcp_pool().acquire() as mcp_client:
+            await tool_catalog.refresh(mcp_client)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"刷新工具目录失败: {str(e)}")
+    return tool_catalog.stats()
+
+@app.get("/api/cache/stats")
+def cache_stats(user: User = Depends(rate_limited_user)):
+    return {
+        "tools": tool_catalog.stats(),
+        "schema": schema_cache.stats(),
+        "results": result_cache.stats(),
+        "answers": answer_cache.stats(),
+        "counters": metrics.counters(),
+        "latency": metrics.histograms(),
+        "llm_router": decision_router.stats(),
+        "admission": admission.stats(),
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "db": async_db.stats(),
+        "password_hasher": password_hasher.stats(),
+    }
+
+# ------------------------------
+# Prometheus 指标（计数器 + 各阶段耗时直方图）
+# ------------------------------
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
 
 # ------------------------------
 # SSE 流式接口（受保护）-deprecated
 # ------------------------------
 @app.get("/service/true_dbinspect")
-def stream_query(question: str, user: User = Depends(get_current_active_user)):
+async def stream_query(
+    request: Request,
+    question: str,
+    no_cache: bool = Query(False, description="跳过答案缓存与查询结果缓存"),
+    user: User = Depends(rate_limited_user)
+):
     """
     SSE 流式接口，必须带 Authorization: Bearer <JWT>
     """
+    # 本次请求（含流式生成过程）的日志关联 ID，可由调用方通过 X-Request-ID 传入
+    cid = set_correlation_id(request.headers.get("x-request-id"))
+    # 命中答案缓存：直接回放，不调用 LLM，因此不排队、不扣 token 额度
+    cached = cached_answer(question, use_cache=not no_cache)
+    if cached is not None:
+        headers = {**request.state.rate_limit_headers, "X-Request-ID": cid}
+        return StreamingResponse(replay_sse(cached), media_type="text/event-stream", headers=headers)
+    # 依赖熔断中：直接返回错误帧，不排队、不扣 token 额度
+    blocked = open_breaker(mcp_breaker, llm_breaker)
+    if blocked is not None:
+        metrics.inc("sse_fail_fast_total", labels={"breaker": blocked.name})
+        headers = {**request.state.rate_limit_headers, "X-Request-ID": cid}
+        return StreamingResponse(fail_fast_sse(blocked), media_type="text/event-stream", headers=headers)
+    # 准入控制：容量与等待队列都满时快速返回 429
+    if admission.would_reject(user.username):
+        metrics.inc("admission_rejected_total")
+        raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试")
+    # LLM token 额度（仅未命中缓存时）：先按预估扣减，回答结束后按实际输出补扣
+    tokens = await rate_limiter.check_tokens(user.username, estimate_question_tokens(question))
+    headers = {**request.state.rate_limit_headers, **tokens.headers(), "X-Request-ID": cid}
+    if not tokens.allowed:
+        raise HTTPException(status_code=429, detail="LLM 用量已达上限，请稍后重试", headers=headers)
     # NOTE: 请把你现有的 mcp_main 函数替换调用
     # 下面示例演示如何包装：如果 mcp_main 是 async generator， StreamingResponse 能直接使用它。
     try:
-        generator = mcp_main(question)  
+        pipeline = charged_sse(user.username, admitted_sse(user.username, mcp_main(question, use_cache=not no_cache)))
+        generator = cached_sse(question, pipeline, use_cache=not no_cache)
     except NameError:
         # 临时 fallback，如果你还没粘回 mcp_main，以便本文件能运行
         async def fallback_gen():
             yield "data: ### 错误：mcp_main 未找到，请将原始实现粘回此文件。\n\n"
         generator = fallback_gen()
-    return StreamingResponse(generator, media_type="text/event-stream")
+    # 客户端断开时取消上游的工具调用与 LLM 流
+    return StreamingResponse(cancel_on_disconnect(request, generator, "sse"), media_type="text/event-stream", headers=headers)
 
 #-----------
 #聚智ws会话接口
@@ -239,111 +280,18 @@ async def ai_question_websocket(
     websocket: WebSocket,
     session_id: str = Query(..., description="前端会话ID")
 ):
+    # 浏览器 WebSocket 无法携带 Authorization 头，JWT 通过连接后的首帧发送（不放在 URL 中，避免写入访问日志）。
+    # 先 accept 再关闭，前端才能收到 1008；在 accept 之前关闭会变成 HTTP 403，浏览器只能看到 1006。
+    # （不再按来源地址兜底：经反向代理后所有用户会共用同一个地址的额度）
     await websocket.accept()
-    ai_ws = None
+    token = await receive_auth_token(websocket)
     try:
-        # 1. 接收前端消息
-        data = await websocket.receive_text()
-        req = json.loads(data)
-        question = req.get("question", "默认问题")
-        print(f"📥 FastAPI收到前端消息：session_id={session_id}, question={question}")
-
-        # 2. 连接Node.js（优化配置）
-        # ai_ws_url = f'ws://127.0.0.1:3001/ws/server-ai?session_id={session_id}'
-        # 生产websocket连接
-        ai_ws_url = await create_ai_ws_url()
-        print(f"🚀 FastAPI正在连接：{ai_ws_url}")
-        ai_ws = await websockets.connect(
-            ai_ws_url,
-            ping_interval=15,  # 延长ping间隔，减少干扰
-            ping_timeout=45,
-            open_timeout=10,
-            close_timeout=10  # 关键：设置关闭超时，等待关闭帧
-        )
-        print(f"✅ FastAPI已连接：{ai_ws_url}")
-
-        # 3. 发送payload
-        payload = {
-            "question": question,
-            "sessionId": session_id
-        }
-        payload_str = json.dumps(payload, ensure_ascii=False)
-        await ai_ws.send(payload_str)
- 
-
-        # 4. 接收响应（优化循环逻辑）
-        while True:
-            try:
-                # 延长超时时间，确保所有流式数据接收完成
-                ai_response = await asyncio.wait_for(ai_ws.recv(), timeout=20.0)
-                ai_data = json.loads(ai_response)
-                print(f"📥 FastAPI收到响应[${session_id}]：status={ai_data['status']}, content={ai_data['content'][:20]}...")
-
-                await websocket.send_text(json.dumps({
-                    "status": ai_data["status"],
-                    "content": ai_data["content"]
-                }))
-
-                # 收到结束信号后，主动等待关闭帧
-                if ai_data["status"] == 2:
-                    print(f"⏳ 等待Node.js关闭连接[${session_id}]")
-                    # 等待Node.js发送关闭帧（最多等5秒）
-                    try:
-                        await asyncio.wait_for(ai_ws.recv(), timeout=5.0)
-                    except asyncio.TimeoutError:
-                        # 没收到额外消息，正常关闭
-                        pass
-                    print(f"✅ 会话[${session_id}]正常结束")
-                    break
-
-            except asyncio.TimeoutError:
-                error_msg = f"接收响应超时（20秒）"
-                print(f"⌛ {error_msg}")
-                await websocket.send_text(json.dumps({
-                    "status": -1,
-                    "content": error_msg
-                }))
-                break
-            except websockets.exceptions.ConnectionClosedOK:
-                # 关键修复：捕获正常关闭异常（收到关闭帧）
-                print(f"✅ Node.js正常关闭连接[${session_id}]")
-                break
-            except websockets.exceptions.ConnectionClosedError as e:
-                # 捕获异常关闭
-                error_msg = f"连接异常关闭：{str(e)}"
-                print(f"❌ {error_msg}")
-                await websocket.send_text(json.dumps({
-                    "status": -1,
-                    "content": error_msg
-                }))
-                break
-            except Exception as recv_err:
-                error_msg = f"接收消息失败：{str(recv_err)}"
-                print(f"❌ {error_msg}")
-                await websocket.send_text(json.dumps({
-                    "status": -1,
-                    "content": error_msg
-                }))
-                break
-
-    except WebSocketDisconnect:
-        print(f"🔌 前端主动断开会话：{session_id}")
-    except Exception as e:
-        error_msg = f"处理失败：{str(e)}"
-        print(f"❌ {error_msg}")
-        await websocket.send_text(json.dumps({
-            "status": -1,
-            "content": error_msg
-        }))
-    finally:
-        # 关键修复：正确关闭Node.js连接
-        if ai_ws :
-            try:
-                # 发送关闭帧给Node.js
-                await ai_ws.close(code=1000, reason="会话结束")
-                print(f"✅ FastAPI关闭ws连接：{session_id}")
-            except Exception as e:
-                print(f"❌ 关闭ws连接失败：{str(e)}")
-        # 延迟关闭前端连接
-        await asyncio.sleep(1.5)
-        await websocket.close()
\ No newline at end of file
+        if not token:
+            raise HTTPException(status_code=401, detail="缺少认证信息")
+        user = await get_current_active_user(authorization=f"Bearer {token}")
+    except HTTPException:
+        await websocket.close(code=1008, reason="unauthorized")
+        return
+    user_key = user.username
+    # 同一前端连接可连续提问；上游连接与签名 URL 均会复用
+    await ai_question_session(websocket, session_id, user_key)
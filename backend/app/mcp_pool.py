@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional
+
+from dotenv import load_dotenv
+from fastmcp import Client
+from fastmcp.client.transports import SSETransport
+from fastmcp.exceptions import ToolError
+
+import metrics
+from app_logging import get_logger
+from circuit_breaker import CircuitBreaker
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+SSE_URL = os.getenv('SSE_URL', 'http://localhost:19068/sse')
+# 连接池大小：同时可借出的 MCP 会话数量上限
+MCP_POOL_SIZE = int(os.getenv('MCP_POOL_SIZE', 4))
+# 启动时预先建立的会话数量
+MCP_POOL_WARM = int(os.getenv('MCP_POOL_WARM', 1))
+# 会话空闲超过该秒数后，借出前先 ping 一次做健康检查
+MCP_POOL_IDLE_PING = float(os.getenv('MCP_POOL_IDLE_PING', 30.0))
+# 建立连接 / 健康检查的超时时间
+MCP_CONNECT_TIMEOUT = float(os.getenv('MCP_CONNECT_TIMEOUT', 10.0))
+# 会话全部借出时等待空闲会话的最长时间
+MCP_POOL_ACQUIRE_TIMEOUT = float(os.getenv('MCP_POOL_ACQUIRE_TIMEOUT', 10.0))
+
+# MCP 服务熔断器：连接与工具调用共用；工具自身返回的错误（如 SQL 错误）与单次工具调用超时（如慢查询）
+# 不计为服务故障，连接超时在 _connect 中转换为 ConnectionError 后计入
+mcp_breaker = CircuitBreaker(
+    "mcp", "MCP 服务", is_failure=lambda exc: not isinstance(exc, (ToolError, asyncio.TimeoutError))
+)
+
+
+class _PooledSession:
+    """连接池中的一个长连接 MCP 会话"""
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.last_used = time.monotonic()
+
+    def is_connected(self) -> bool:
+        try:
+            return self.client.is_connected()
+        except Exception:
+            return False
+
+    async def close(self) -> None:
+        try:
+            await self.client.__aexit__(None, None, None)
+        except Exception as e:
+            logger.warning("关闭 MCP 会话失败: %s", e)
+
+
+class MCPPoolBusy(Exception):
+    """等待空闲 MCP 会话超时"""
+
+
+class MCPSessionPool:
+    """
+    应用生命周期内的 MCP 会话池。
+    在 FastAPI startup 中 start()，shutdown 中 close()；
+    请求内通过 `async with pool.acquire() as client` 借用已握手的会话，
+    避免每个问题都新建 SSETransport + ping/list_tools。
+    """
+
+    def __init__(
+        self,
+        url: str = SSE_URL,
+        size: int = MCP_POOL_SIZE,
+        idle_ping: float = MCP_POOL_IDLE_PING,
+        connect_timeout: float = MCP_CONNECT_TIMEOUT,
+        acquire_timeout: float = MCP_POOL_ACQUIRE_TIMEOUT,
+        message_handler: Any = None,
+    ):
+        self.url = url
+        self.size = max(1, size)
+        self.idle_ping = idle_ping
+        self.connect_timeout = connect_timeout
+        self.acquire_timeout = acquire_timeout
+        self.message_handler = message_handler
+        self._idle: List[_PooledSession] = []
+        self._slots = asyncio.Semaphore(self.size)
+        self._closed = False
+
+    # ------------------------------
+    # 生命周期
+    # ------------------------------
+    async def start(self, warm: int = MCP_POOL_WARM) -> None:
+        """预热若干会话；MCP 服务暂不可用时不阻塞应用启动"""
+        self._closed = False
+        for _ in range(min(warm, self.size)):
+            try:
+                self._idle.append(await self._connect())
+            except Exception as e:
+                logger.warning("MCP 会话预热失败（将在首次使用时重连）: %s", e)
+                break
+
+    async def close(self) -> None:
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for session in idle:
+            await session.close()
+
+    # ------------------------------
+    # 借用 / 归还
+    # ------------------------------
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Client]:
+        """借出一个健康的 MCP 会话；传输错误、取消或连接已断开时丢弃，下次自动重连"""
+        if self._closed:
+            raise RuntimeError("MCP 会话池已关闭")
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("mcp_pool_timeouts_total")
+            raise MCPPoolBusy(f"MCP 会话繁忙，等待超过 {self.acquire_timeout:g} 秒") from None
+        try:
+            session = await self._checkout()
+            broken = False
+            try:
+                yield session.client
+            except (ToolError, asyncio.TimeoutError):
+                # 工具自身报错（如 SQL 错误）与单次调用超时不代表会话损坏，会话照常归还
+                raise
+            except BaseException:
+                # 传输 / 连接错误与取消：会话状态不确定，丢弃
+                broken = True
+                raise
+            finally:
+                if broken or self._closed or not session.is_connected():
+                    await session.close()
+                else:
+                    session.last_used = time.monotonic()
+                    self._idle.append(session)
+        finally:
+            self._slots.release()
+
+    async def _checkout(self) -> _PooledSession:
+        while self._idle:
+            session = self._idle.pop()
+            if await self._healthy(session):
+                return session
+            await session.close()
+        return await self._connect()
+
+    async def _healthy(self, session: _PooledSession) -> bool:
+        if not session.is_connected():
+            return False
+        if time.monotonic() - session.last_used < self.idle_ping:
+            return True
+        try:
+            await asyncio.wait_for(session.client.ping(), timeout=self.connect_timeout)
+            return True
+        except Exception as e:
+            logger.info("MCP 会话健康检查失败，重新连接: %s", e)
+            return False
+
+    async def _connect(self) -> _PooledSession:
+        client = Client(SSETransport(self.url), message_handler=self.message_handler)
+        async with mcp_breaker.call():
+            with metrics.span("mcp_connect"):
+                try:
+                    await asyncio.wait_for(client.__aenter__(), timeout=self.connect_timeout)
+                except asyncio.TimeoutError:
+                    raise ConnectionError(f"连接 MCP 服务超时（{self.connect_timeout:g} 秒）") from None
+        return _PooledSession(client)
+
+    def stats(self) -> dict[str, Any]:
+        return {"size": self.size, "idle": len(self._idle)}
+
+
+mcp_pool: Optional[MCPSessionPool] = None
+
+
+def get_mcp_pool() -> MCPSessionPool:
+    """获取全局会话池；未在 startup 中初始化时按默认配置懒创建"""
+    global mcp_pool
+    if mcp_pool is None:
+        mcp_pool = MCPSessionPool()
+    return mcp_pool
@@ -0,0 +1,106 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# ----------------------------------------------------
+# 进程内计数器与直方图（Prometheus 文本格式导出）
+# ----------------------------------------------------
+# 秒级延迟分桶：覆盖缓存命中（毫秒级）到 LLM 全流程（分钟级）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_counters: Dict[Tuple[str, LabelKey], float] = defaultdict(float)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(DEFAULT_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_histograms: Dict[Tuple[str, LabelKey], _Histogram] = defaultdict(_Histogram)
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+def inc(name: str, value: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+    _counters[(name, _label_key(labels))] += value
+
+
+def observe(name: str, seconds: float, labels: Optional[Dict[str, str]] = None) -> None:
+    _histograms[(name, _label_key(labels))].observe(seconds)
+
+
+@contextmanager
+def span(stage: str, **labels: str) -> Iterator[None]:
+    """
+    记录一个流水线阶段的耗时到 stage_duration_seconds{stage=...}；
+    阶段内抛出异常（取消除外）时同时计入 stage_errors_total。
+    """
+    started = time.perf_counter()
+    stage_labels = {"stage": stage, **labels}
+    try:
+        yield
+    except Exception:
+        inc("stage_errors_total", labels=stage_labels)
+        raise
+    finally:
+        observe("stage_duration_seconds", time.perf_counter() - started, stage_labels)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def counters() -> Dict[str, float]:
+    return {name + _format_labels(key): value for (name, key), value in _counters.items()}
+
+
+def histograms() -> Dict[str, Dict[str, float]]:
+    """各直方图的次数与平均值，供 /api/cache/stats 等调试接口使用"""
+    return {
+        name + _format_labels(key): {"count": h.count, "avg": round(h.sum / h.count, 4) if h.count else 0.0}
+        for (name, key), h in _histograms.items()
+    }
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    typed = set()
+    for (name, key), value in sorted(_counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(key)} {value}")
+    for (name, key), h in sorted(_histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(DEFAULT_BUCKETS, h.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(key, (('le', repr(bound)),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {h.count}")
+        lines.append(f"{name}_sum{_format_labels(key)} {h.sum}")
+        lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+    return "\n".join(lines) + "\n"
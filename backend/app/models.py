@@ -3,6 +3,8 @@ from typing import Optional
 from datetime import datetime
 
 class User(SQLModel, table=True):
+    # 沿用 main 原来的 users 表，已注册的用户无需迁移数据
+    __tablename__ = "users"
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True, unique=True)
     full_name: Optional[str] = None
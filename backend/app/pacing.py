@@ -0,0 +1,72 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, List
+
+from dotenv import load_dotenv
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 输出节奏模式：none = 不做任何处理（零附加延迟）；coalesce = 按时间/大小预算合并数据块
+PACING_MODE = os.getenv('PACING_MODE', 'none')
+# coalesce 模式下，缓冲区最多保留的毫秒数
+PACING_FLUSH_MS = float(os.getenv('PACING_FLUSH_MS', 50.0))
+# coalesce 模式下，缓冲区达到该字符数立即输出
+PACING_FLUSH_CHARS = int(os.getenv('PACING_FLUSH_CHARS', 64))
+
+
+async def pace(
+    chunks: AsyncIterator[str],
+    mode: str = PACING_MODE,
+    flush_ms: float = PACING_FLUSH_MS,
+    flush_chars: int = PACING_FLUSH_CHARS,
+) -> AsyncIterator[str]:
+    """
+    控制流式输出节奏。
+    默认直接透传，不引入任何 sleep；coalesce 模式把细碎的 token
+    合并成更大的块，降低 SSE 帧数，但单个字符最多延迟 flush_ms。
+    """
+    if mode != 'coalesce':
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    budget = flush_ms / 1000.0
+    buffer: List[str] = []
+    size = 0
+    started = 0.0
+    iterator = chunks.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None
+            if buffer:
+                timeout = max(0.0, budget - (time.monotonic() - started))
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 时间预算用完：先输出已缓冲内容，继续等待同一个数据块
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            if not buffer:
+                started = time.monotonic()
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= flush_chars:
+                yield "".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
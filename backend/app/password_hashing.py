@@ -0,0 +1,118 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+import metrics
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# bcrypt 成本因子；调整后旧哈希会在用户下次登录时自动重新计算
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+# 专用哈希进程数，0 表示在线程池中计算（调试用）
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+# 排队 + 计算中的哈希任务上限，超过后直接拒绝（503）
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 32))
+# 工作进程的启动方式：服务进程内已有事件循环与后台线程，fork 可能死锁，默认 forkserver（不支持时用 spawn）
+PASSWORD_HASH_START_METHOD = os.getenv(
+    'PASSWORD_HASH_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+# min/max 与默认值一致：成本因子不同的哈希在 verify_and_update 时会被判定为需要更新
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+def _secret(password: str) -> bytes:
+    # bcrypt 只使用前 72 字节
+    return password.encode("utf8")[:72]
+
+
+# 以下函数会被提交到子进程执行，子进程导入本模块时按同样的配置构造 pwd_context
+def hash_password(password: str) -> str:
+    return pwd_context.hash(_secret(password))
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return pwd_context.verify(_secret(password), hashed)
+
+
+def verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(_secret(password), hashed)
+
+
+class HasherBusy(Exception):
+    """哈希任务排队已满"""
+
+
+class PasswordHasher:
+    """在独立进程池中执行 bcrypt，避免占用事件循环所在进程的 CPU"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        """在应用启动时创建进程池（工作进程由 forkserver / spawn 启动，不继承事件循环与线程）"""
+        self._get_executor()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers > 0 and self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(PASSWORD_HASH_START_METHOD),
+            )
+        return self._executor
+
+    async def _run(self, name: str, fn, *args):
+        if self.pending >= self.max_pending:
+            metrics.inc("password_hash_rejected_total")
+            raise HasherBusy("登录请求过多，请稍后重试")
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            metrics.observe("password_hashing_seconds", time.perf_counter() - started, {"op": name})
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", hash_password, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """返回 (是否匹配, 新哈希)；成本因子变化时新哈希不为 None，调用方负责写回"""
+        verified, new_hash = await self._run("verify", verify_and_update, password, hashed)
+        if verified and new_hash:
+            metrics.inc("password_rehash_total")
+        return verified, new_hash
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rounds": BCRYPT_ROUNDS,
+        }
+
+
+password_hasher = PasswordHasher()
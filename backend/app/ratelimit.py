@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, Dict, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+from result_compaction import estimate_tokens
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+# memory = 进程内；sqlite = 多个 uvicorn worker 共享同一个 SQLite 文件
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', './ratelimit.db')
+# 请求令牌桶：每分钟补充数量与桶容量（突发）
+RATE_LIMIT_REQUESTS_PER_MIN = float(os.getenv('RATE_LIMIT_REQUESTS_PER_MIN', 30))
+RATE_LIMIT_REQUESTS_BURST = float(os.getenv('RATE_LIMIT_REQUESTS_BURST', 10))
+# LLM token 令牌桶：每分钟补充数量与桶容量
+RATE_LIMIT_TOKENS_PER_MIN = float(os.getenv('RATE_LIMIT_TOKENS_PER_MIN', 20000))
+RATE_LIMIT_TOKENS_BURST = float(os.getenv('RATE_LIMIT_TOKENS_BURST', 60000))
+# 每个问题在提问时预估的 token 数（系统提示词 + 工具 schema + 工具结果），回答结束后按实际输出再扣减
+RATE_LIMIT_BASE_TOKENS = int(os.getenv('RATE_LIMIT_BASE_TOKENS', 2000))
+
+
+class RateLimitResult:
+    __slots__ = ("allowed", "remaining", "retry_after", "kind")
+
+    def __init__(self, allowed: bool, remaining: float, retry_after: float, kind: str):
+        self.allowed = allowed
+        self.remaining = remaining
+        self.retry_after = retry_after
+        self.kind = kind
+
+    def headers(self) -> Dict[str, str]:
+        headers = {f"X-RateLimit-Remaining-{self.kind.capitalize()}": str(max(int(self.remaining), 0))}
+        if not self.allowed:
+            headers["Retry-After"] = str(max(int(self.retry_after + 0.999), 1))
+        return headers
+
+
+def _refill(tokens: float, updated: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _retry_after(tokens: float, cost: float, allowed: bool, rate: float) -> float:
+    return 0.0 if allowed else (cost - tokens) / rate
+
+
+class MemoryBackend:
+    """进程内令牌桶"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str, cost: float, capacity: float, rate: float, allow_debt: bool = False) -> Tuple[bool, float, float]:
+        now = time.time()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = _refill(tokens, updated, now, capacity, rate)
+        allowed = allow_debt or tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        return allowed, tokens, _retry_after(tokens, cost, allowed, rate)
+
+
+class SQLiteBackend:
+    """SQLite 令牌桶：用 BEGIN IMMEDIATE 串行化多进程之间的读-改-写"""
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float, capacity: float, rate: float, allow_debt: bool = False) -> Tuple[bool, float, float]:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens = _refill(tokens, updated, now, capacity, rate)
+                allowed = allow_debt or tokens >= cost
+                if allowed:
+                    tokens -= cost
+                conn.execute(
+                    "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return allowed, tokens, _retry_after(tokens, cost, allowed, rate)
+
+
+class RateLimiter:
+    """
+    每用户的请求数与 LLM token 令牌桶。
+    提问时按预估 token 扣减；回答结束后按实际输出追加扣减（允许透支，透支期间后续请求被拒绝）。
+    """
+
+    def __init__(self, backend: str = RATE_LIMIT_BACKEND):
+        self._backend = SQLiteBackend() if backend == 'sqlite' else MemoryBackend()
+        self._blocking = backend == 'sqlite'
+
+    async def _take(self, key: str, cost: float, capacity: float, per_min: float, allow_debt: bool = False):
+        rate = per_min / 60.0
+        if self._blocking:
+            return await asyncio.to_thread(self._backend.take, key, cost, capacity, rate, allow_debt)
+        return self._backend.take(key, cost, capacity, rate, allow_debt)
+
+    async def check_request(self, user: str) -> RateLimitResult:
+        if not RATE_LIMIT_ENABLED:
+            return RateLimitResult(True, RATE_LIMIT_REQUESTS_BURST, 0.0, "requests")
+        allowed, remaining, retry_after = await self._take(
+            f"req:{user}", 1, RATE_LIMIT_REQUESTS_BURST, RATE_LIMIT_REQUESTS_PER_MIN
+        )
+        if not allowed:
+            metrics.inc("ratelimit_requests_rejected_total")
+        return RateLimitResult(allowed, remaining, retry_after, "requests")
+
+    async def check_tokens(self, user: str, estimated: int) -> RateLimitResult:
+        if not RATE_LIMIT_ENABLED:
+            return RateLimitResult(True, RATE_LIMIT_TOKENS_BURST, 0.0, "tokens")
+        allowed, remaining, retry_after = await self._take(
+            f"tok:{user}", min(estimated, RATE_LIMIT_TOKENS_BURST), RATE_LIMIT_TOKENS_BURST, RATE_LIMIT_TOKENS_PER_MIN
+        )
+        if not allowed:
+            metrics.inc("ratelimit_tokens_rejected_total")
+        return RateLimitResult(allowed, remaining, retry_after, "tokens")
+
+    async def charge_tokens(self, user: str, tokens: int) -> None:
+        if RATE_LIMIT_ENABLED and tokens > 0:
+            await self._take(f"tok:{user}", tokens, RATE_LIMIT_TOKENS_BURST, RATE_LIMIT_TOKENS_PER_MIN, allow_debt=True)
+
+
+rate_limiter = RateLimiter()
+
+
+def estimate_question_tokens(question: str) -> int:
+    return RATE_LIMIT_BASE_TOKENS + estimate_tokens(question)
+
+
+async def charged_sse(user: str, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+    """透传 SSE 帧，结束后按输出内容估算 token 并计入用户额度"""
+    output = []
+    try:
+        async for frame in stream:
+            if frame.startswith("data: "):
+                output.append(frame[6:])
+            yield frame
+    finally:
+        await rate_limiter.charge_tokens(user, estimate_tokens("".join(output)))
+
+
+def remaining_budget(*results: RateLimitResult) -> Dict[str, int]:
+    return {result.kind: max(int(result.remaining), 0) for result in results}
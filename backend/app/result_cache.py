@@ -0,0 +1,141 @@
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+QUERY_TOOL = "get_table_data"
+# 查询结果有效期（秒）
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 60.0))
+# 缓存总字节上限，超过后按 LRU 淘汰
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# 单条结果超过该字节数不缓存
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv('RESULT_CACHE_MAX_ENTRY_BYTES', 4 * 1024 * 1024))
+
+# 字符串字面量 / 带引号的标识符保持原样，其余部分做空白与大小写归一化
+_SQL_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|[^'\"`]+")
+_READ_ONLY = re.compile(r"^\(*\s*(select|with|show|explain|describe|desc)\b")
+# 以 select / with 开头也可能有副作用：数据修改型 CTE、SELECT ... INTO、加锁读、序列 / 锁函数等
+_SIDE_EFFECTS = re.compile(
+    r"\b(insert|update|delete|merge|upsert|truncate|drop|alter|create|grant|revoke|call|exec|execute|copy|lock|into)\b"
+    r"|\breplace\s+into\b"
+    r"|\bfor\s+(no\s+key\s+)?(update|share|key\s+share)\b"
+    r"|\b(nextval|setval|lastval|pg_advisory_\w*|pg_try_advisory_\w*|pg_notify|pg_sleep\w*|get_lock|release_lock|sleep|dblink\w*)\s*\("
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """折叠空白、去掉末尾分号，并把引号之外的部分转为小写"""
+    parts = []
+    for token in _SQL_TOKENS.findall(sql.strip().rstrip(";")):
+        if token[0] in "'\"`":
+            parts.append(token)
+        else:
+            parts.append(re.sub(r"\s+", " ", token.lower()))
+    return "".join(parts).strip()
+
+
+def is_read_only(normalized_sql: str) -> bool:
+    """只接受单条、不含写操作与副作用函数的查询；字面量与带引号的标识符中的内容不参与判断"""
+    if not _READ_ONLY.match(normalized_sql):
+        return False
+    bare = "".join(" " if token[0] in "'\"`" else token for token in _SQL_TOKENS.findall(normalized_sql))
+    if ";" in bare:
+        return False
+    return not _SIDE_EFFECTS.search(bare)
+
+
+class ResultCache:
+    """
+    get_table_data 查询结果缓存。
+    键为 (目标库, 归一化 SQL)，带 TTL，并按结果字节数做 LRU 淘汰；
+    只缓存只读查询。
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESULT_CACHE_TTL,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, int, float]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, target: str, arguments: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+        sql = arguments.get("querysql")
+        if not isinstance(sql, str) or not sql.strip():
+            return None
+        normalized = normalize_sql(sql)
+        if not is_read_only(normalized):
+            return None
+        return target, normalized
+
+    def get(self, key: Tuple[str, str]) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            metrics.inc("cache_requests_total", labels={"cache": "result", "result": "miss"})
+            return None
+        result, size, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self._remove(key)
+            self.misses += 1
+            metrics.inc("cache_requests_total", labels={"cache": "result", "result": "miss"})
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        metrics.inc("cache_requests_total", labels={"cache": "result", "result": "hit"})
+        return result
+
+    def put(self, key: Tuple[str, str], result: Any) -> None:
+        if isinstance(result, dict) and "error" in result:
+            return
+        size = len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8"))
+        # 单条超过整个缓存容量时直接跳过，否则淘汰循环会把它连同其他条目一起清空
+        if size > min(self.max_entry_bytes, self.max_bytes):
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (result, size, time.monotonic())
+        self.bytes += size
+        while self.bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,207 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 查询结果超过行数或字节数上限时，改为列式摘要
+TOOL_RESULT_MAX_ROWS = int(os.getenv('TOOL_RESULT_MAX_ROWS', 200))
+TOOL_RESULT_MAX_BYTES = int(os.getenv('TOOL_RESULT_MAX_BYTES', 32 * 1024))
+# 摘要中保留的样例行数
+TOOL_RESULT_SAMPLE_ROWS = int(os.getenv('TOOL_RESULT_SAMPLE_ROWS', 20))
+# 每列统计 distinct 值时最多扫描的不同值数量
+TOOL_RESULT_DISTINCT_CAP = int(os.getenv('TOOL_RESULT_DISTINCT_CAP', 1000))
+# 第二次（及之后）LLM 请求的 token 预算，以及估算 token 时每个 token 对应的 UTF-8 字节数
+LLM_TOKEN_BUDGET = int(os.getenv('LLM_TOKEN_BUDGET', 24000))
+TOKEN_BYTES = float(os.getenv('TOKEN_BYTES', 3.0))
+
+_ROW_KEYS = ("rows", "data", "result", "records", "items")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text.encode("utf-8")) / TOKEN_BYTES) + 1
+
+
+def _split_rows(result: Any) -> Tuple[Optional[List[Any]], Optional[str], Dict[str, Any]]:
+    """找出结果中的行列表，返回 (行, 行所在的键, 其余字段)"""
+    if isinstance(result, list):
+        return result, None, {}
+    if isinstance(result, dict):
+        for key in _ROW_KEYS:
+            if isinstance(result.get(key), list):
+                rest = {k: v for k, v in result.items() if k != key}
+                return result[key], key, rest
+    return None, None, {}
+
+
+def _column_names(rows: List[Any], rest: Dict[str, Any]) -> List[Any]:
+    if rows and isinstance(rows[0], dict):
+        names: Dict[Any, None] = {}
+        for row in rows[:TOOL_RESULT_SAMPLE_ROWS]:
+            if isinstance(row, dict):
+                names.update(dict.fromkeys(row))
+        return list(names)
+    columns = rest.get("columns")
+    if isinstance(columns, list):
+        return columns
+    width = max((len(row) for row in rows if isinstance(row, (list, tuple))), default=0)
+    return list(range(width))
+
+
+def _cell(row: Any, column: Any, index: int) -> Any:
+    if isinstance(row, dict):
+        return row.get(column)
+    if isinstance(row, (list, tuple)) and index < len(row):
+        return row[index]
+    return None
+
+
+def column_stats(rows: List[Any], columns: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """逐列统计：非空数量、distinct 数量，数值列附带 min / max / mean，其余列附带全列的字典序 min / max"""
+    stats = {}
+    for index, column in enumerate(columns):
+        non_null = 0
+        distinct = set()
+        numbers = []
+        text_min: Optional[str] = None
+        text_max: Optional[str] = None
+        for row in rows:
+            value = _cell(row, column, index)
+            if value is None:
+                continue
+            non_null += 1
+            if len(distinct) < TOOL_RESULT_DISTINCT_CAP:
+                distinct.add(value if isinstance(value, (str, int, float, bool)) else _dumps(value))
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                numbers.append(value)
+            else:
+                text = value if isinstance(value, str) else str(value)
+                if text_min is None or text < text_min:
+                    text_min = text
+                if text_max is None or text > text_max:
+                    text_max = text
+        column_stat: Dict[str, Any] = {
+            "non_null": non_null,
+            "distinct": len(distinct) if len(distinct) < TOOL_RESULT_DISTINCT_CAP else f">={TOOL_RESULT_DISTINCT_CAP}",
+        }
+        if numbers:
+            column_stat.update(min=min(numbers), max=max(numbers), mean=round(sum(numbers) / len(numbers), 4))
+        elif text_min is not None:
+            column_stat.update(min=text_min, max=text_max)
+        stats[str(column)] = column_stat
+    return stats
+
+
+def compact_result(result: Any) -> Any:
+    """
+    压缩查询结果：未超出行数 / 字节上限时原样返回；
+    否则返回包含总行数、样例行和逐列统计的列式摘要，并标记 truncated；
+    摘要仍超出字节上限时缩减样例行与长字符串，而不是丢掉行数和统计。
+    """
+    rows, _, rest = _split_rows(result)
+    if rows is not None:
+        if len(rows) <= TOOL_RESULT_MAX_ROWS and len(_dumps(result).encode("utf-8")) <= TOOL_RESULT_MAX_BYTES:
+            return result
+        columns = _column_names(rows, rest)
+        summary = {
+            "truncated": True,
+            "row_count": len(rows),
+            "columns": columns,
+            "sample_rows": rows[:TOOL_RESULT_SAMPLE_ROWS],
+            "column_stats": column_stats(rows, columns),
+            "note": f"结果共 {len(rows)} 行，已压缩为样例行与逐列统计，请基于这些信息回答，必要时使用聚合 SQL 重新查询",
+        }
+        summary.update({k: v for k, v in rest.items() if k != "columns"})
+        return _fit_summary(summary, TOOL_RESULT_MAX_BYTES)
+    return truncate_text(result, TOOL_RESULT_MAX_BYTES)
+
+
+def _clip(value: Any, max_chars: int) -> Any:
+    """递归截短过长的字符串"""
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else value[:max_chars] + "…"
+    if isinstance(value, dict):
+        return {k: _clip(v, max_chars) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clip(v, max_chars) for v in value]
+    return value
+
+
+def _fit_summary(summary: Dict[str, Any], max_bytes: int) -> Any:
+    """
+    让摘要放进 max_bytes：先逐步减半样例行，再逐步缩短单元格与统计中的长字符串，
+    最后去掉样例行；row_count / columns / note 始终保留。
+    """
+    fixed = {"truncated", "row_count", "columns", "note"}
+    original = {k: v for k, v in summary.items() if k not in fixed}
+    rows = original["sample_rows"]
+    sample_count = len(rows)
+    max_chars: Optional[int] = None
+    while True:
+        for key, value in original.items():
+            value = rows[:sample_count] if key == "sample_rows" else value
+            summary[key] = value if max_chars is None else _clip(value, max_chars)
+        if len(_dumps(summary).encode("utf-8")) <= max_bytes:
+            return summary
+        if sample_count > 1:
+            sample_count //= 2
+        elif max_chars is None:
+            max_chars = 256
+        elif max_chars > 16:
+            max_chars //= 2
+        elif sample_count:
+            sample_count = 0
+        else:
+            break
+    # 列数过多时统计本身也放不下：只保留行数、列名与提示
+    summary = {k: summary[k] for k in ("truncated", "row_count", "columns", "note")}
+    return summary if len(_dumps(summary).encode("utf-8")) <= max_bytes else truncate_text(summary, max_bytes)
+
+
+def truncate_text(result: Any, max_bytes: int) -> Any:
+    """非结构化结果按字节截断"""
+    text = result if isinstance(result, str) else _dumps(result)
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return result
+    return {
+        "truncated": True,
+        "original_bytes": len(encoded),
+        "preview": encoded[:max_bytes].decode("utf-8", errors="ignore"),
+    }
+
+
+def fit_token_budget(messages: List[Dict[str, Any]], budget: int = LLM_TOKEN_BUDGET) -> int:
+    """
+    让整个消息历史保持在 token 预算内：超出时从最大的 tool 消息开始截断。
+    返回截断的消息数量。
+    """
+    total = sum(estimate_tokens(m.get("content") or "") for m in messages)
+    truncated = 0
+    tool_messages = sorted(
+        (m for m in messages if m.get("role") == "tool"),
+        key=lambda m: len(m.get("content") or ""),
+        reverse=True,
+    )
+    for message in tool_messages:
+        if total <= budget:
+            break
+        content = message.get("content") or ""
+        tokens = estimate_tokens(content)
+        # 预留截断标记自身的开销
+        keep_bytes = max(256, int((tokens - (total - budget)) * TOKEN_BYTES) - 128)
+        compacted = _dumps(truncate_text(content, keep_bytes))
+        if len(compacted) >= len(content):
+            continue
+        message["content"] = compacted
+        total -= tokens - estimate_tokens(compacted)
+        truncated += 1
+    return truncated
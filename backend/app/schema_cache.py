@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+from app_logging import get_logger
+from crud import get_db_config
+from deps import async_db
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 后台刷新间隔（秒）
+SCHEMA_CACHE_REFRESH = float(os.getenv('SCHEMA_CACHE_REFRESH', 300.0))
+# 缓存条目最长有效期（秒），超过后视为未命中，回源 MCP
+SCHEMA_CACHE_TTL = float(os.getenv('SCHEMA_CACHE_TTL', 900.0))
+# 预热时是否预取所有表的结构定义，以及预取的表数量上限和并发
+# （整轮刷新只借用一个 MCP 会话，并发为该会话上同时进行的请求数，不占用其他会话）
+SCHEMA_PREFETCH_DEFINITIONS = os.getenv('SCHEMA_PREFETCH_DEFINITIONS', '1') == '1'
+SCHEMA_PREFETCH_MAX_TABLES = int(os.getenv('SCHEMA_PREFETCH_MAX_TABLES', 200))
+SCHEMA_PREFETCH_CONCURRENCY = int(os.getenv('SCHEMA_PREFETCH_CONCURRENCY', 2))
+
+TABLES_TOOL = "get_dbSchema_tables_list"
+DEFINITION_TOOL = "get_table_definition"
+DEFAULT_TARGET = "default"
+
+# fetch(tool_name, arguments) -> 解析后的工具结果
+ToolFetcher = Callable[[str, Dict[str, Any]], Awaitable[Any]]
+# `async with session() as fetch:` 借用一个 MCP 会话，在其上调用工具
+ToolSession = Callable[[], AsyncContextManager[ToolFetcher]]
+
+
+async def current_target_db() -> str:
+    """读取 DBConfig.target_url 作为缓存键；未配置或读取失败时使用 default"""
+    try:
+        cfg = await async_db.run(get_db_config)
+        if cfg and cfg.target_url:
+            return cfg.target_url
+    except Exception as e:
+        logger.warning("读取 DBConfig 失败，使用默认目标库: %s", e)
+    return DEFAULT_TARGET
+
+
+def _is_error(result: Any) -> bool:
+    return isinstance(result, dict) and "error" in result
+
+
+def _definition_key(arguments: Dict[str, Any]) -> Tuple[str, str]:
+    table_name = str(arguments.get("table_name") or "").strip().lower()
+    schema = str(arguments.get("schema") or "").strip().lower()
+    return table_name, schema
+
+
+def table_refs(result: Any) -> List[Dict[str, Any]]:
+    """从 get_dbSchema_tables_list 的结果中提取 get_table_definition 的参数"""
+    items = result
+    if isinstance(result, dict):
+        items = result.get("tables") or result.get("data") or result.get("result") or []
+    if not isinstance(items, list):
+        return []
+    refs = []
+    for item in items:
+        if isinstance(item, str):
+            schema, _, table_name = item.rpartition(".")
+        elif isinstance(item, dict):
+            table_name = item.get("table_name") or item.get("name") or item.get("table") or ""
+            schema = item.get("schema") or item.get("table_schema") or ""
+        else:
+            continue
+        if table_name:
+            arguments = {"table_name": table_name}
+            if schema:
+                arguments["schema"] = schema
+            refs.append(arguments)
+    return refs
+
+
+class _TargetSchema:
+    """单个目标库的表清单与表结构缓存"""
+
+    def __init__(self):
+        self.tables: Optional[Tuple[Any, float]] = None
+        self.definitions: Dict[Tuple[str, str], Tuple[Any, Dict[str, Any], float]] = {}
+
+
+class SchemaCache:
+    """
+    位于 MCP 工具调用前的数据库结构缓存。
+    按 DBConfig.target_url 分库缓存 get_dbSchema_tables_list / get_table_definition 的结果，
+    启动时预热、后台定期刷新，命中时直接在本地应答，不经过 MCP 服务和数据库。
+    generation 在结构变化或目标库切换时递增，供下游缓存判断失效。
+    """
+
+    def __init__(self, ttl: float = SCHEMA_CACHE_TTL, refresh_interval: float = SCHEMA_CACHE_REFRESH):
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.target = DEFAULT_TARGET
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._targets: Dict[str, _TargetSchema] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def cacheable(self, tool_name: str) -> bool:
+        return tool_name in (TABLES_TOOL, DEFINITION_TOOL)
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at < self.ttl
+
+    def _schema(self) -> _TargetSchema:
+        return self._targets.setdefault(self.target, _TargetSchema())
+
+    # ------------------------------
+    # 查询 / 写入
+    # ------------------------------
+    def lookup(self, tool_name: str, arguments: Dict[str, Any]) -> Optional[Any]:
+        if not self.cacheable(tool_name):
+            return None
+        schema = self._schema()
+        entry = None
+        if tool_name == TABLES_TOOL and schema.tables:
+            result, loaded_at = schema.tables
+            entry = (result, loaded_at)
+        elif tool_name == DEFINITION_TOOL:
+            cached = schema.definitions.get(_definition_key(arguments))
+            if cached:
+                entry = (cached[0], cached[2])
+        if entry and self._fresh(entry[1]):
+            self.hits += 1
+            metrics.inc("cache_requests_total", labels={"cache": "schema", "result": "hit"})
+            return entry[0]
+        self.misses += 1
+        metrics.inc("cache_requests_total", labels={"cache": "schema", "result": "miss"})
+        return None
+
+    def store(self, tool_name: str, arguments: Dict[str, Any], result: Any) -> None:
+        if not self.cacheable(tool_name) or _is_error(result):
+            return
+        schema = self._schema()
+        now = time.monotonic()
+        if tool_name == TABLES_TOOL:
+            previous = schema.tables[0] if schema.tables else None
+            schema.tables = (result, now)
+        else:
+            key = _definition_key(arguments)
+            cached = schema.definitions.get(key)
+            previous = cached[0] if cached else None
+            schema.definitions[key] = (result, dict(arguments), now)
+        if previous is not None and _dumps(previous) != _dumps(result):
+            self.generation += 1
+
+    def set_target(self, target: str) -> None:
+        """目标库切换：后续查询改用新库的缓存"""
+        target = target or DEFAULT_TARGET
+        if target != self.target:
+            self.target = target
+            self._targets.pop(target, None)
+            self.generation += 1
+
+    # ------------------------------
+    # 预热 / 后台刷新
+    # ------------------------------
+    async def refresh(self, fetch: ToolFetcher) -> None:
+        self.set_target(await current_target_db())
+        schema = self._schema()
+        tables = await fetch(TABLES_TOOL, {})
+        self.store(TABLES_TOOL, {}, tables)
+
+        # 已缓存的表结构一并刷新，预热时补齐表清单中的全部表
+        pending = {key: arguments for key, (_, arguments, _) in schema.definitions.items()}
+        if SCHEMA_PREFETCH_DEFINITIONS and not _is_error(tables):
+            for arguments in table_refs(tables)[:SCHEMA_PREFETCH_MAX_TABLES]:
+                pending.setdefault(_definition_key(arguments), arguments)
+
+        semaphore = asyncio.Semaphore(SCHEMA_PREFETCH_CONCURRENCY)
+
+        async def load_definition(arguments: Dict[str, Any]) -> None:
+            async with semaphore:
+                try:
+                    self.store(DEFINITION_TOOL, arguments, await fetch(DEFINITION_TOOL, arguments))
+                except Exception as e:
+                    logger.warning("预取表结构 %s 失败: %s", arguments, e)
+
+        await asyncio.gather(*(load_definition(arguments) for arguments in pending.values()))
+
+    async def _run(self, session: ToolSession) -> None:
+        while True:
+            try:
+                async with session() as fetch:
+                    await self.refresh(fetch)
+            except Exception as e:
+                logger.warning("数据库结构缓存刷新失败: %s", e)
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, session: ToolSession) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(session))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        schema = self._targets.get(self.target)
+        return {
+            "target": re.sub(r"://[^@/]*@", "://***@", self.target),
+            "generation": self.generation,
+            "tables_cached": bool(schema and schema.tables),
+            "definitions": len(schema.definitions) if schema else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+schema_cache = SchemaCache()
@@ -0,0 +1,130 @@
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app_logging import get_logger, throttled
+
+logger = get_logger(__name__)
+
+try:
+    # 可选依赖：安装 orjson 时使用更快的 JSON 解析
+    import orjson
+
+    def loads(data: bytes) -> Any:
+        return orjson.loads(data)
+except ImportError:
+    def loads(data: bytes) -> Any:
+        return json.loads(data)
+
+DONE = b"[DONE]"
+
+
+class SSEEvent:
+    """一个完整的 SSE 事件；data 保持为 bytes，避免逐块解码产生的字符串分配"""
+
+    __slots__ = ("event", "data", "id")
+
+    def __init__(self, data: bytes, event: Optional[str] = None, id: Optional[str] = None):
+        self.data = data
+        self.event = event
+        self.id = id
+
+    def json(self) -> Any:
+        return loads(self.data)
+
+
+class SSEDecoder:
+    """
+    基于字节块的增量 SSE 解码器。
+    网络分块在行中间断开时，未完成的半行留在缓冲区等待下一块；
+    支持多行 data、event / id 字段、注释行和 \\r\\n / \\r 换行。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+        self._event: Optional[str] = None
+        self._id: Optional[str] = None
+        # 上一块以 \r 结尾：下一块开头的 \n 属于同一个 \r\n 换行
+        self._skip_lf = False
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        events: List[SSEEvent] = []
+        buffer = self._buffer
+        buffer += chunk
+        start = 0
+        if self._skip_lf and buffer[:1] == b"\n":
+            start = 1
+        self._skip_lf = False
+        size = len(buffer)
+        while start < size:
+            lf = buffer.find(b"\n", start)
+            cr = buffer.find(b"\r", start, lf if lf >= 0 else size)
+            end = cr if cr >= 0 else lf
+            if end < 0:
+                break
+            self._line(bytes(buffer[start:end]), events)
+            start = end + 1
+            if cr >= 0:
+                if start == size:
+                    self._skip_lf = True
+                elif buffer[start] == 0x0A:
+                    start += 1
+        if start:
+            del buffer[:start]
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束时处理缓冲区剩余内容，并派发最后一个未以空行结尾的事件"""
+        events: List[SSEEvent] = []
+        if self._buffer:
+            line = bytes(self._buffer)
+            self._buffer.clear()
+            self._line(line, events)
+        self._skip_lf = False
+        self._line(b"", events)
+        return events
+
+    def _line(self, line: bytes, events: List[SSEEvent]) -> None:
+        if not line:
+            if self._data:
+                events.append(SSEEvent(b"\n".join(self._data), self._event, self._id))
+            self._data = []
+            self._event = None
+            return
+        if line[0] == 0x3A:  # ":" 注释 / 心跳
+            return
+        field, sep, value = line.partition(b":")
+        if sep and value[:1] == b" ":
+            value = value[1:]
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif field == b"id":
+            self._id = value.decode("utf-8", errors="replace")
+
+
+async def iter_sse_events(byte_chunks: AsyncIterator[bytes]) -> AsyncIterator[SSEEvent]:
+    decoder = SSEDecoder()
+    async for chunk in byte_chunks:
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.flush():
+        yield event
+
+
+async def iter_chat_deltas(byte_chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """解析 OpenAI 兼容的流式响应，逐个产出 choices[0].delta；遇到 [DONE] 结束"""
+    async for event in iter_sse_events(byte_chunks):
+        if event.data == DONE:
+            return
+        try:
+            payload = event.json()
+        except ValueError:
+            # 上游异常时每个块都可能失败，限频避免日志淹没
+            if throttled("sse_decode_error", 5.0):
+                logger.warning("解析流式数据失败: %r", event.data[:200])
+            continue
+        choices = payload.get("choices") if isinstance(payload, dict) else None
+        if choices:
+            yield choices[0].get("delta") or {}
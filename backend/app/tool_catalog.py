@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+from fastmcp import Client
+from fastmcp.client.messages import MessageHandler
+
+import metrics
+from app_logging import get_logger
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 工具目录缓存有效期（秒），<=0 表示只在服务端通知或手动刷新时失效
+TOOL_CATALOG_TTL = float(os.getenv('TOOL_CATALOG_TTL', 600.0))
+
+
+def to_llm_tools(tool_defs: List[Any]) -> List[Dict[str, Any]]:
+    """将 MCP 工具定义转换为 LLM 可识别的 function 格式"""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": tool.name,
+                "description": tool.description,
+                "parameters": tool.inputSchema
+            }
+        }
+        for tool in tool_defs
+    ]
+
+
+class ToolCatalog:
+    """
+    MCP 工具目录缓存。
+    转换后的 function schema 只在首次使用、TTL 到期、服务端发出
+    tools/list_changed 通知或手动刷新时重新 list_tools()。
+    """
+
+    def __init__(self, ttl: float = TOOL_CATALOG_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self._tools: List[Dict[str, Any]] = []
+        self._loaded_at = 0.0
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def _expired(self) -> bool:
+        if self._stale:
+            return True
+        return self.ttl > 0 and time.monotonic() - self._loaded_at > self.ttl
+
+    async def get(self, pool: Any) -> List[Dict[str, Any]]:
+        """命中缓存时不借用 MCP 会话；需要刷新时才从会话池借用一个"""
+        if not self._expired():
+            return self._tools
+        async with self._lock:
+            # 并发请求只有一个真正去刷新
+            if self._expired():
+                async with pool.acquire() as mcp_client:
+                    await self.refresh(mcp_client)
+        return self._tools
+
+    async def refresh(self, mcp_client: Client) -> List[Dict[str, Any]]:
+        with metrics.span("list_tools"):
+            tool_defs = await mcp_client.list_tools()
+        self._tools = to_llm_tools(tool_defs)
+        self._loaded_at = time.monotonic()
+        self._stale = False
+        self.version += 1
+        return self._tools
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "count": len(self._tools),
+            "age": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            "stale": self._expired(),
+        }
+
+
+class CatalogMessageHandler(MessageHandler):
+    """接收 MCP 服务端的 tools/list_changed 通知并使目录缓存失效"""
+
+    def __init__(self, catalog: ToolCatalog):
+        super().__init__()
+        self.catalog = catalog
+
+    async def on_tool_list_changed(self, message: Any) -> None:
+        logger.info("MCP 工具列表已变更，目录缓存失效")
+        self.catalog.invalidate()
+
+
+tool_catalog = ToolCatalog()
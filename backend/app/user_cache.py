@@ -0,0 +1,88 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event, inspect
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 用户信息缓存时间（秒）；多 worker 部署时，其他 worker 上的禁用/修改最多延迟这么久生效
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 30.0))
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 1024))
+# 已验证 JWT 的缓存数量上限，每个 token 缓存到其 exp 为止
+JWT_CACHE_MAX_ENTRIES = int(os.getenv('JWT_CACHE_MAX_ENTRIES', 4096))
+
+
+class ExpiringCache:
+    """有界 LRU 缓存，每个条目带绝对过期时间（time.time()）"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, expires_at: float) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (value, expires_at)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# username -> 已脱离会话的 User 对象（只读使用）
+user_cache = ExpiringCache(USER_CACHE_MAX_ENTRIES)
+# token -> username
+token_cache = ExpiringCache(JWT_CACHE_MAX_ENTRIES)
+
+
+def get_cached_user(username: str):
+    return user_cache.get(username)
+
+
+def cache_user(user) -> None:
+    user_cache.put(user.username, user, time.time() + USER_CACHE_TTL)
+
+
+def invalidate_user(username: str) -> None:
+    user_cache.pop(username)
+
+
+def _on_user_changed(mapper, connection, target) -> None:
+    # 用户名被修改时，旧用户名对应的缓存也要失效
+    names = {target.username}
+    names.update(inspect(target).attrs.username.history.deleted or ())
+    for name in names:
+        invalidate_user(name)
+
+
+def watch_user_model(model) -> None:
+    """
+    ORM 层修改/删除用户后立即失效本进程缓存。
+    注意：session.query(...).update() 这类批量语句不会触发，只能等 TTL 过期。
+    """
+    event.listen(model, "after_update", _on_user_changed)
+    event.listen(model, "after_delete", _on_user_changed)
@@ -0,0 +1,457 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from fastapi import WebSocket
+import websockets
+from websockets.protocol import State
+
+import metrics
+from admission import admission, AdmissionRejected
+from answer_cache import answer_cache, ANSWER_CACHE_ENABLED
+from ratelimit import rate_limiter, estimate_question_tokens, remaining_budget
+from llmapi4 import create_ai_ws_url
+from result_compaction import estimate_tokens
+from app_logging import get_logger, set_correlation_id
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
+logger = get_logger(__name__)
+
+# ----------------------------------------------------
+# 配置 (Configuration)
+# ----------------------------------------------------
+load_dotenv()
+# 签名 URL 的缓存时间（秒），需小于网关允许的 date 偏差窗口
+AI_WS_URL_TTL = float(os.getenv('AI_WS_URL_TTL', 240.0))
+# 回答结束后是否保留上游连接供同一前端会话的下一个问题复用（网关支持同一连接多轮问答时再开启）
+AI_WS_REUSE = os.getenv('AI_WS_REUSE', '0') == '1'
+# 保留空闲上游连接的会话数上限（每个会话最多一条），以及空闲连接的最长保留时间
+AI_WS_POOL_SIZE = int(os.getenv('AI_WS_POOL_SIZE', 8))
+AI_WS_MAX_IDLE = float(os.getenv('AI_WS_MAX_IDLE', 60.0))
+# 回答结束后观察连接的时间（秒）：期间仍收到尾帧的连接不再复用
+AI_WS_DRAIN_TIMEOUT = float(os.getenv('AI_WS_DRAIN_TIMEOUT', 0.5))
+# 等待上游下一帧的超时时间
+AI_WS_RECV_TIMEOUT = float(os.getenv('AI_WS_RECV_TIMEOUT', 20.0))
+# 连接建立后等待前端发送认证帧的超时时间
+AI_WS_AUTH_TIMEOUT = float(os.getenv('AI_WS_AUTH_TIMEOUT', 10.0))
+# 前端连接空闲多久没有新问题后主动关闭
+AI_WS_SESSION_IDLE = float(os.getenv('AI_WS_SESSION_IDLE', 300.0))
+# 转发模式：passthrough = 原样转发；filter = 只保留 status/content 字段（不做 JSON 解码）；decode = 完整解码再编码
+AI_WS_RELAY_MODE = os.getenv('AI_WS_RELAY_MODE', 'filter')
+# 每隔多少帧记录一次转发日志（DEBUG 级别；结束帧总会记录）
+AI_WS_LOG_SAMPLE = int(os.getenv('AI_WS_LOG_SAMPLE', 50))
+
+_STATUS = re.compile(r'"status"\s*:\s*(-?\d+)')
+_CONTENT = re.compile(r'"content"\s*:\s*("(?:[^"\\]|\\.)*"|null)')
+
+_signed_url: Optional[Tuple[str, float]] = None
+
+
+async def get_ai_ws_url() -> str:
+    """在有效期内复用 HMAC 签名后的网关 URL"""
+    global _signed_url
+    if _signed_url and time.monotonic() - _signed_url[1] < AI_WS_URL_TTL:
+        return _signed_url[0]
+    url = await create_ai_ws_url()
+    _signed_url = (url, time.monotonic())
+    return url
+
+
+def invalidate_ai_ws_url() -> None:
+    global _signed_url
+    _signed_url = None
+
+
+def is_open(conn) -> bool:
+    return conn is not None and conn.state is State.OPEN
+
+
+def error_frame(content: str) -> str:
+    return json.dumps({"status": -1, "content": content})
+
+
+async def receive_auth_token(websocket: WebSocket) -> Optional[str]:
+    """
+    读取前端的首帧 {"type": "auth", "token": "<JWT>"}；超时、断开或格式不符时返回 None。
+    token 不放在 URL 中，避免被访问日志 / 代理日志记录。
+    """
+    try:
+        data = await asyncio.wait_for(websocket.receive_text(), timeout=AI_WS_AUTH_TIMEOUT)
+        message = json.loads(data)
+    except (asyncio.TimeoutError, ValueError, KeyError, RuntimeError):
+        return None
+    if not isinstance(message, dict) or message.get("type") != "auth":
+        return None
+    token = message.get("token")
+    return token if isinstance(token, str) and token else None
+
+
+def peek_status(raw: str) -> Optional[int]:
+    """只读取帧中的 status 字段，用于判断流是否结束"""
+    match = _STATUS.search(raw)
+    return int(match.group(1)) if match else None
+
+
+def relay_frame(raw, mode: str = AI_WS_RELAY_MODE) -> Tuple[str, Optional[int]]:
+    """
+    把上游帧转换为发给前端的帧，返回 (帧, status)。
+    passthrough / filter 模式不做完整的 JSON 解码与再编码；
+    filter 模式下无法定位字段时回退到 decode。
+    """
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    status = peek_status(raw)
+    if mode == "passthrough" and status is not None:
+        return raw, status
+    if mode == "filter" and status is not None:
+        content = _CONTENT.search(raw)
+        if content:
+            return f'{{"status": {status}, "content": {content.group(1)}}}', status
+    ai_data = json.loads(raw)
+    frame = json.dumps({
+        "status": ai_data["status"],
+        "content": ai_data["content"]
+    })
+    return frame, ai_data["status"]
+
+
+class UpstreamPool:
+    """
+    上游网关 WebSocket 连接池：回答结束后的连接只留给同一前端会话的下一个问题复用，
+    按 session_scope（认证用户 + 前端会话）隔离，不同会话 / 用户之间从不共享连接。归还前先确认连接上没有尾帧。
+    """
+
+    def __init__(self, size: int = AI_WS_POOL_SIZE, max_idle: float = AI_WS_MAX_IDLE):
+        self.size = size
+        self.max_idle = max_idle
+        self._idle: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+        self._draining: Set[asyncio.Task] = set()
+
+    async def acquire(self, scope: str) -> Tuple[object, bool]:
+        """返回 (连接, 是否为复用连接)"""
+        idle = self._idle.pop(scope, None)
+        if idle is not None:
+            conn, released_at = idle
+            if is_open(conn) and time.monotonic() - released_at < self.max_idle:
+                metrics.inc("ws_upstream_reused_total")
+                return conn, True
+            await self.discard(conn)
+        return await self.connect(), False
+
+    async def connect(self):
+        url = await get_ai_ws_url()
+        try:
+            with metrics.span("gateway_connect"):
+                conn = await websockets.connect(
+                url,
+                    ping_interval=15,  # 延长ping间隔，减少干扰
+                    ping_timeout=45,
+                    open_timeout=10,
+                    close_timeout=10  # 关键：设置关闭超时，等待关闭帧
+                )
+        except Exception:
+            # 签名可能已过期或被拒绝，下次重新签名
+            invalidate_ai_ws_url()
+            raise
+        metrics.inc("ws_upstream_connects_total")
+        logger.info("已连接上游网关")
+        return conn
+
+    async def release(self, scope: str, conn, reusable: bool) -> None:
+        if not (reusable and AI_WS_REUSE and is_open(conn)):
+            await self.discard(conn)
+            return
+        # 在后台确认连接已安静后再放回，不阻塞当前问题的收尾
+        task = asyncio.create_task(self._check_in(scope, conn))
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+    async def _check_in(self, scope: str, conn) -> None:
+        try:
+            await asyncio.wait_for(conn.recv(), timeout=AI_WS_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            await self.discard(conn, timeout=1.0)
+            raise
+        except Exception:
+            await self.discard(conn)
+            return
+        else:
+            # 回答结束后仍有帧到达：这些帧不能被下一个问题读到，直接关闭
+            metrics.inc("ws_upstream_trailing_frames_total")
+            await self.discard(conn)
+            return
+        if not is_open(conn):
+            await self.discard(conn)
+            return
+        previous = self._idle.pop(scope, None)
+        if previous is not None:
+            await self.discard(previous[0])
+        self._idle[scope] = (conn, time.monotonic())
+        while len(self._idle) > self.size:
+            _, (evicted, _) = self._idle.popitem(last=False)
+            await self.discard(evicted)
+
+    async def release_session(self, scope: str) -> None:
+        """前端会话结束：关闭为其保留的空闲连接"""
+        idle = self._idle.pop(scope, None)
+        if idle is not None:
+            await self.discard(idle[0])
+
+    async def discard(self, conn, code: int = 1000, reason: str = "会话结束", timeout: Optional[float] = None) -> None:
+        try:
+            if timeout is None:
+                await conn.close(code=code, reason=reason)
+            else:
+                await asyncio.wait_for(conn.close(code=code, reason=reason), timeout=timeout)
+        except Exception as e:
+            logger.warning("关闭ws连接失败：%s", e)
+
+    async def close(self) -> None:
+        for task in list(self._draining):
+            task.cancel()
+        idle, self._idle = self._idle, OrderedDict()
+        for conn, _ in idle.values():
+            await self.discard(conn)
+
+
+upstream_pool = UpstreamPool()
+
+
+class FrontendReader:
+    """持续读取前端消息：问题进入队列，断开时置位 gone，使转发过程能及时感知前端离开"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.questions: asyncio.Queue = asyncio.Queue()
+        self.gone = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("text") is not None:
+                    await self.questions.put(message["text"])
+        except Exception:
+            return
+        finally:
+            self.gone.set()
+
+    async def next_message(self, timeout: float) -> Optional[str]:
+        """等待下一条前端消息；前端断开或超时返回 None"""
+        getter = asyncio.ensure_future(self.questions.get())
+        gone = asyncio.ensure_future(self.gone.wait())
+        try:
+            done, _ = await asyncio.wait({getter, gone}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            return getter.result() if getter in done else None
+        finally:
+            getter.cancel()
+            gone.cancel()
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+
+class FrontendGone(Exception):
+    pass
+
+
+# 上游网关熔断器：以一次完整问答为单位统计；前端断开与网关正常关闭不计为故障
+gateway_breaker = CircuitBreaker(
+    "gateway", "AI 网关",
+    is_failure=lambda exc: not isinstance(exc, (FrontendGone, websockets.exceptions.ConnectionClosedOK))
+)
+
+
+async def _recv(conn, reader: FrontendReader):
+    """接收上游下一帧，同时感知前端断开与超时"""
+    recv_task = asyncio.ensure_future(conn.recv())
+    gone = asyncio.ensure_future(reader.gone.wait())
+    try:
+        done, _ = await asyncio.wait({recv_task, gone}, timeout=AI_WS_RECV_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        gone.cancel()
+    if recv_task in done:
+        return recv_task.result()
+    recv_task.cancel()
+    if reader.gone.is_set():
+        raise FrontendGone()
+    raise asyncio.TimeoutError()
+
+
+def session_scope(user_key: str, session_id: str) -> str:
+    """session_id 由前端提供，可能与其他用户重复；上游连接与答案缓存按 (认证用户, session_id) 隔离"""
+    return f"{user_key}/{session_id}"
+
+
+def answer_namespace(scope: str) -> str:
+    """网关的回答依赖 sessionId 对应的对话上下文，答案缓存只在同一用户的同一会话内复用"""
+    return f"ws:{scope}"
+
+
+async def relay_question(
+    websocket: WebSocket, reader: FrontendReader, session_id: str, scope: str, question: str
+) -> List[str]:
+    """转发一个问题并把上游的流式回答写回前端，返回已转发的帧；scope 见 session_scope"""
+    started = time.perf_counter()
+    payload_str = json.dumps({"question": question, "sessionId": session_id}, ensure_ascii=False)
+    conn, reused = await upstream_pool.acquire(scope)
+    try:
+        await conn.send(payload_str)
+    except websockets.exceptions.ConnectionClosed:
+        if not reused:
+            raise
+        conn, reused = await upstream_pool.connect(), False
+        await conn.send(payload_str)
+
+    recorded = []
+    reusable = False
+    try:
+        while True:
+            try:
+                ai_response = await _recv(conn, reader)
+            except websockets.exceptions.ConnectionClosed:
+                if reused and not recorded:
+                    # 复用的连接已被网关关闭：换新连接重发一次
+                    logger.info("复用的上游连接已关闭，重新连接")
+                    conn, reused = await upstream_pool.connect(), False
+                    await conn.send(payload_str)
+                    continue
+                raise
+            frame, status = relay_frame(ai_response)
+            await websocket.send_text(frame)
+            if not recorded:
+                metrics.observe("ws_ttft_seconds", time.perf_counter() - started)
+            recorded.append(frame)
+            metrics.inc("ws_relay_frames_total")
+            # 采样记录，避免逐帧写日志
+            if AI_WS_LOG_SAMPLE > 0 and len(recorded) % AI_WS_LOG_SAMPLE == 1:
+                logger.debug("转发响应：第 %d 帧，status=%s", len(recorded), status)
+
+            if status == 2:
+                logger.info("回答结束，共 %d 帧", len(recorded),
+                            extra={"fields": {"frames": len(recorded), "seconds": round(time.perf_counter() - started, 3)}})
+                reusable = True
+                metrics.observe("ws_answer_seconds", time.perf_counter() - started)
+                if ANSWER_CACHE_ENABLED:
+                    answer_cache.put(answer_namespace(scope), question, recorded)
+                return recorded
+            if status == -1:
+                return recorded
+    except FrontendGone:
+        # 前端已断开：立即关闭上游，不再等待关闭帧
+        metrics.inc("ws_abandoned_total")
+        await upstream_pool.discard(conn, code=1001, reason="前端已断开", timeout=1.0)
+        conn = None
+        raise
+    finally:
+        if conn is not None:
+            await upstream_pool.release(scope, conn, reusable)
+
+
+async def ai_question_session(websocket: WebSocket, session_id: str, user_key: str) -> None:
+    """
+    前端 WebSocket 会话：同一连接上可以连续提问，
+    每个问题先经过准入控制，再借用（或新建）一个上游连接，回答结束后归还连接池。
+    调用方负责 accept 与认证。
+    """
+    # 会话内所有日志都带上 session_id，便于按会话检索
+    set_correlation_id(session_id)
+    scope = session_scope(user_key, session_id)
+    reader = FrontendReader(websocket)
+
+    async def notify_position(position: int) -> None:
+        # status=0 为排队通知，不属于回答内容
+        await websocket.send_text(json.dumps({
+            "status": 0,
+            "queue": position,
+            "content": f"排队中，前方还有 {max(position - 1, 0)} 个请求"
+        }, ensure_ascii=False))
+    try:
+        while True:
+            data = await reader.next_message(AI_WS_SESSION_IDLE)
+            if data is None:
+                break
+            try:
+                req = json.loads(data)
+                question = req.get("question", "默认问题")
+            except (ValueError, AttributeError):
+                await websocket.send_text(error_frame("消息格式错误"))
+                continue
+            logger.info("收到前端问题", extra={"fields": {"question": question[:200]}})
+
+            # 限流：WS 无法使用响应头，额度不足时返回错误帧，剩余额度以 status=0 帧告知
+            requests = await rate_limiter.check_request(user_key)
+            if not requests.allowed:
+                await websocket.send_text(error_frame(f"请求过于频繁，请 {requests.retry_after:.0f} 秒后重试"))
+                continue
+
+            # 同一会话内重复的问题直接回放缓存的答案帧，不再连接上游
+            cached_frames = answer_cache.get(answer_namespace(scope), question) if ANSWER_CACHE_ENABLED else None
+            if cached_frames is not None:
+                for frame in cached_frames:
+                    await websocket.send_text(frame)
+                continue
+
+            # 网关熔断中：直接返回错误帧，不再排队等待连接超时
+            if gateway_breaker.is_open:
+                await websocket.send_text(error_frame(str(CircuitOpen(gateway_breaker))))
+                continue
+
+            tokens = await rate_limiter.check_tokens(user_key, estimate_question_tokens(question))
+            if not tokens.allowed:
+                await websocket.send_text(error_frame(f"LLM 用量已达上限，请 {tokens.retry_after:.0f} 秒后重试"))
+                continue
+            await websocket.send_text(json.dumps({
+                "status": 0,
+                "ratelimit": remaining_budget(requests, tokens),
+                "content": ""
+            }))
+
+            try:
+                async with admission.slot(user_key, on_wait=notify_position):
+                    async with gateway_breaker.call():
+                        frames = await relay_question(websocket, reader, session_id, scope, question)
+                await rate_limiter.charge_tokens(user_key, estimate_tokens("".join(frames)))
+            except (AdmissionRejected, CircuitOpen) as e:
+                await websocket.send_text(error_frame(str(e)))
+            except FrontendGone:
+                break
+            except asyncio.TimeoutError:
+                metrics.inc("ws_timeouts_total")
+                error_msg = f"接收响应超时（{AI_WS_RECV_TIMEOUT:g}秒）"
+                logger.warning(error_msg)
+                await websocket.send_text(error_frame(error_msg))
+            except websockets.exceptions.ConnectionClosedOK:
+                logger.info("上游网关正常关闭连接")
+            except websockets.exceptions.ConnectionClosedError as e:
+                error_msg = f"连接异常关闭：{str(e)}"
+                logger.warning(error_msg)
+                await websocket.send_text(error_frame(error_msg))
+            except Exception as e:
+                error_msg = f"处理失败：{str(e)}"
+                logger.exception(error_msg)
+                await websocket.send_text(error_frame(error_msg))
+    except Exception as e:
+        logger.exception("会话异常：%s", e)
+    finally:
+        frontend_gone = reader.gone.is_set()
+        reader.stop()
+        await upstream_pool.release_session(scope)
+        if frontend_gone:
+            logger.info("前端主动断开会话")
+        else:
+            # 由服务端发起正常的关闭握手
+            try:
+                await websocket.close(code=1000)
+            except Exception:
+                pass
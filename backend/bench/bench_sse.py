@@ -0,0 +1,118 @@
+"""
+SSE 解析基准：对比旧的 aiter_text + splitlines 解析方式与增量字节解码器。
+
+用法：
+    python bench/bench_sse.py                      # 使用合成的录制流
+    python bench/bench_sse.py --file stream.txt    # 回放真实录制的 LLM 响应体
+录制方式示例：curl -N ... $BASE_URL > stream.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import AsyncIterator, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from sse_decoder import iter_chat_deltas  # noqa: E402
+
+
+def synthetic_stream(tokens: int = 2000) -> bytes:
+    """模拟 OpenAI 兼容接口的流式响应体"""
+    words = ["订单", "数量", "SELECT", " count(*)", " FROM", " orders", "。", "\n", "| 日期 | 数量 |", " 2024-01-01"]
+    lines = []
+    for i in range(tokens):
+        payload = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "bench",
+            "choices": [{"index": 0, "delta": {"content": words[i % len(words)]}, "finish_reason": None}],
+        }
+        lines.append(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def split_chunks(body: bytes, seed: int = 7) -> List[bytes]:
+    """按随机大小切分网络分块，模拟在行中间断开的情况"""
+    rng = random.Random(seed)
+    chunks, pos = [], 0
+    while pos < len(body):
+        size = rng.randint(16, 512)
+        chunks.append(body[pos:pos + size])
+        pos += size
+    return chunks
+
+
+async def byte_source(chunks: List[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def text_source(chunks: List[bytes]) -> AsyncIterator[str]:
+    for chunk in chunks:
+        yield chunk.decode("utf-8", errors="ignore")
+
+
+async def legacy_parse(chunks: List[bytes]) -> int:
+    """旧实现：逐块 splitlines + json.loads，半行会解析失败被丢弃"""
+    tokens = 0
+    async for chunk in text_source(chunks):
+        if not chunk.strip():
+            continue
+        for line in chunk.splitlines():
+            line = line.strip()
+            if line.startswith("data: "):
+                data = line[6:]
+                if data == "[DONE]":
+                    return tokens
+                try:
+                    json_data = json.loads(data)
+                    content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                    if content:
+                        tokens += 1
+                except json.JSONDecodeError:
+                    continue
+    return tokens
+
+
+async def decoder_parse(chunks: List[bytes]) -> int:
+    tokens = 0
+    async for delta in iter_chat_deltas(byte_source(chunks)):
+        if delta.get("content"):
+            tokens += 1
+    return tokens
+
+
+async def run(name: str, parser, chunks: List[bytes], rounds: int) -> None:
+    tokens = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        tokens = await parser(chunks)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<8} {len(chunks) * rounds / elapsed:>12.0f} chunks/s   tokens/round={tokens}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="录制的原始 SSE 响应体")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            body = f.read()
+    else:
+        body = synthetic_stream()
+    chunks = split_chunks(body)
+    print(f"stream: {len(body)} bytes, {len(chunks)} chunks, {args.rounds} rounds")
+    asyncio.run(run("legacy", legacy_parse, chunks, args.rounds))
+    asyncio.run(run("decoder", decoder_parse, chunks, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
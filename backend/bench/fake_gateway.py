@@ -0,0 +1,53 @@
+"""
+本地 AI 网关替身：接收 {"question", "sessionId"}，按设定速率推送 status=1 的内容帧，最后推送 status=2。
+同一连接可以连续提问（对应 AI_WS_REUSE=1）。不校验签名参数。
+
+用法：
+    python bench/fake_gateway.py --port 19103 --ttft 0.3 --tps 50 --tokens 200
+后端配置：WS_BASE_URL=http://127.0.0.1:19103
+"""
+import argparse
+import asyncio
+import json
+
+import websockets
+
+WORDS = ["根据", "查询", "结果", "，", "共有", " 3 ", "种", "订单状态", "。", "\n"]
+settings = argparse.Namespace()
+
+
+async def handle(conn) -> None:
+    interval = 1.0 / settings.tps if settings.tps > 0 else 0.0
+    try:
+        async for message in conn:
+            session_id = json.loads(message).get("sessionId")
+            await asyncio.sleep(settings.ttft)
+            for i in range(settings.tokens):
+                await conn.send(json.dumps({"status": 1, "content": WORDS[i % len(WORDS)], "sessionId": session_id},
+                                           ensure_ascii=False))
+                if interval:
+                    await asyncio.sleep(interval)
+            await conn.send(json.dumps({"status": 2, "content": "", "sessionId": session_id}))
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+
+async def serve() -> None:
+    async with websockets.serve(handle, settings.host, settings.port):
+        print(f"fake gateway listening on ws://{settings.host}:{settings.port}")
+        await asyncio.Future()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=19103)
+    parser.add_argument("--ttft", type=float, default=0.3, help="首帧前的延迟（秒）")
+    parser.add_argument("--tps", type=float, default=50.0, help="每秒推送的内容帧数，0 表示不限速")
+    parser.add_argument("--tokens", type=int, default=200, help="每个回答的内容帧数")
+    parser.parse_args(namespace=settings)
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
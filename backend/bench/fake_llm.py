@@ -0,0 +1,97 @@
+"""
+本地 OpenAI 兼容 LLM 替身：决策阶段（stream=false）返回工具调用，流式阶段按设定的首字延迟与速率输出 token。
+
+用法：
+    python bench/fake_llm.py --port 19101 --ttft 0.3 --tps 50 --tokens 200
+后端配置：BASE_URL=http://127.0.0.1:19101/v1/chat/completions
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ["共有", " 3 ", "种", "订单状态", "：", "\n", "| 状态 | 数量 |", "\n", "| paid | 412 |", "。"]
+QUERY = "SELECT status, count(*) AS n FROM orders GROUP BY status"
+
+app = FastAPI(title="fake llm")
+settings = argparse.Namespace()
+
+
+def _has_tool_results(messages) -> bool:
+    return any(message.get("role") == "tool" for message in messages)
+
+
+def _chunk(delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "bench",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream_answer():
+    await asyncio.sleep(settings.ttft)
+    interval = 1.0 / settings.tps if settings.tps > 0 else 0.0
+    for i in range(settings.tokens):
+        yield _chunk({"content": WORDS[i % len(WORDS)]})
+        if interval:
+            await asyncio.sleep(interval)
+    yield _chunk({}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    if body.get("stream"):
+        return StreamingResponse(_stream_answer(), media_type="text/event-stream")
+
+    await asyncio.sleep(settings.decision_latency)
+    if body.get("tools") and not _has_tool_results(messages) and random.random() >= settings.direct_ratio:
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:8]}",
+                "type": "function",
+                "function": {"name": "get_table_data", "arguments": json.dumps({"querysql": QUERY})},
+            }],
+        }
+        finish_reason = "tool_calls"
+    else:
+        message = {"role": "assistant", "content": "".join(WORDS)}
+        finish_reason = "stop"
+    return JSONResponse({
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "bench",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=19101)
+    parser.add_argument("--ttft", type=float, default=0.3, help="流式首个 token 前的延迟（秒）")
+    parser.add_argument("--tps", type=float, default=50.0, help="每秒输出的 token 数，0 表示不限速")
+    parser.add_argument("--tokens", type=int, default=200, help="每个流式回答的 token 数")
+    parser.add_argument("--decision-latency", type=float, default=0.5, help="决策阶段（非流式）响应延迟（秒）")
+    parser.add_argument("--direct-ratio", type=float, default=0.0, help="决策阶段直接回答、不调用工具的比例")
+    parser.parse_args(namespace=settings)
+    uvicorn.run(app, host=settings.host, port=settings.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+本地 MCP 替身：用 fastmcp 在 SQLite 上实现后端依赖的三个数据库工具
+（get_dbSchema_tables_list / get_table_definition / get_table_data），通过 SSE 提供服务。
+
+用法：
+    python bench/fake_mcp.py --port 19102 --rows 5000 --latency 0.02
+后端配置：SSE_URL=http://127.0.0.1:19102/sse
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+from fastmcp import FastMCP
+
+mcp = FastMCP("bench-db")
+settings = argparse.Namespace()
+
+
+def seed(path: str, rows: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        DROP TABLE IF EXISTS orders;
+        DROP TABLE IF EXISTS customers;
+        CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT NOT NULL, city TEXT);
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY,
+            customer_id INTEGER REFERENCES customers(id),
+            status TEXT NOT NULL,
+            amount REAL NOT NULL,
+            created_at TEXT NOT NULL
+        );
+    """)
+    rng = random.Random(7)
+    cities = ["北京", "上海", "广州", "深圳", "杭州"]
+    conn.executemany("INSERT INTO customers VALUES (?, ?, ?)",
+                     [(i, f"客户{i}", rng.choice(cities)) for i in range(1, 201)])
+    start = datetime(2024, 1, 1)
+    conn.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?)", [
+        (i, rng.randint(1, 200), rng.choice(["paid", "shipped", "refunded"]),
+         round(rng.uniform(10, 2000), 2), (start + timedelta(minutes=rng.randint(0, 525600))).isoformat())
+        for i in range(1, rows + 1)
+    ])
+    conn.commit()
+    conn.close()
+
+
+def _query(sql: str, params=()):
+    conn = sqlite3.connect(f"file:{settings.db}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(sql, params)
+        columns = [col[0] for col in cursor.description or []]
+        return columns, cursor.fetchall()
+    finally:
+        conn.close()
+
+
+@mcp.tool()
+async def get_dbSchema_tables_list() -> dict:
+    """列出数据库中的所有表"""
+    await asyncio.sleep(settings.latency)
+    _, rows = _query("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+    return {"tables": [{"schema": "main", "table_name": name} for (name,) in rows]}
+
+
+@mcp.tool()
+async def get_table_definition(table_name: str, schema: str = "main") -> dict:
+    """获取表的列定义"""
+    await asyncio.sleep(settings.latency)
+    _, rows = _query("SELECT name, type, \"notnull\", pk FROM pragma_table_info(?)", (table_name,))
+    if not rows:
+        return {"error": f"表不存在: {table_name}"}
+    return {
+        "schema": schema,
+        "table_name": table_name,
+        "columns": [{"name": n, "type": t, "nullable": not nn, "primary_key": bool(pk)} for n, t, nn, pk in rows],
+    }
+
+
+@mcp.tool()
+async def get_table_data(querysql: str) -> dict:
+    """执行只读 SQL 并返回结果"""
+    await asyncio.sleep(settings.latency)
+    try:
+        columns, rows = _query(querysql)
+    except sqlite3.Error as e:
+        return {"error": str(e)}
+    return {"columns": columns, "rows": [list(row) for row in rows]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=19102)
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "bench_mcp.db"))
+    parser.add_argument("--rows", type=int, default=5000, help="orders 表的行数")
+    parser.add_argument("--latency", type=float, default=0.02, help="每次工具调用附加的延迟（秒）")
+    parser.parse_args(namespace=settings)
+    seed(settings.db, settings.rows)
+    mcp.run(transport="sse", host=settings.host, port=settings.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+压测：以固定并发驱动 /service/true_dbinspect（SSE）、/ws/ai-question（WS）与 /api/login，
+统计首 token 时间（TTFT）与总耗时的 p50/p95/p99 以及吞吐。
+
+完全离线运行（本地替身 + 临时用户库）：
+    python bench/load.py --start-fakes --start-backend --scenario all --concurrency 16 --requests 200
+压测已启动的后端：
+    python bench/fake_llm.py & python bench/fake_mcp.py & python bench/fake_gateway.py &
+    cd app && BASE_URL=http://127.0.0.1:19101/v1/chat/completions SSE_URL=http://127.0.0.1:19102/sse \\
+        WS_BASE_URL=http://127.0.0.1:19103 RATE_LIMIT_ENABLED=0 uvicorn main:app --port 19069
+    python bench/load.py --base http://127.0.0.1:19069 --scenario sse
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+QUESTION = "统计每种状态的订单数量"
+
+
+class Sample:
+    __slots__ = ("ok", "ttft", "total", "tokens")
+
+    def __init__(self, ok: bool, ttft: Optional[float], total: float, tokens: int = 0):
+        self.ok = ok
+        self.ttft = ttft
+        self.total = total
+        self.tokens = tokens
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法百分位"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def unique_question() -> str:
+    # 附加随机后缀，避免命中答案缓存（包括相似度匹配）
+    return f"{QUESTION} {uuid.uuid4().hex}"
+
+
+# ------------------------------
+# 场景
+# ------------------------------
+async def login(client: httpx.AsyncClient, username: str, password: str) -> Sample:
+    started = time.perf_counter()
+    try:
+        response = await client.post("/api/login", data={"username": username, "password": password})
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    total = time.perf_counter() - started
+    return Sample(ok, total, total)
+
+
+async def sse_question(client: httpx.AsyncClient, token: str) -> Sample:
+    started = time.perf_counter()
+    ttft, tokens, ok = None, 0, False
+    pending_event = False
+    try:
+        async with client.stream(
+            "GET", "/service/true_dbinspect",
+            params={"question": unique_question(), "no_cache": "true"},
+            headers={"Authorization": f"Bearer {token}"},
+        ) as response:
+            ok = response.status_code == 200
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    pending_event = True
+                elif line.startswith("data: "):
+                    # 进度 / 排队等命名事件不计入首 token；错误帧记为失败，不计入 token
+                    if pending_event:
+                        pass
+                    elif line.startswith("data: ❌") or line.startswith('data: {"error"'):
+                        ok = False
+                    else:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        tokens += 1
+                    pending_event = False
+    except httpx.HTTPError:
+        ok = False
+    return Sample(ok and ttft is not None, ttft, time.perf_counter() - started, tokens)
+
+
+async def ws_question(conn, started: float) -> Sample:
+    ttft, tokens = None, 0
+    await conn.send(json.dumps({"question": unique_question()}, ensure_ascii=False))
+    while True:
+        frame = json.loads(await conn.recv())
+        status = frame.get("status")
+        if status == 1:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            tokens += 1
+        elif status == 2:
+            return Sample(True, ttft, time.perf_counter() - started, tokens)
+        elif status == -1:
+            return Sample(False, ttft, time.perf_counter() - started, tokens)
+
+
+# ------------------------------
+# 驱动
+# ------------------------------
+async def setup_users(client: httpx.AsyncClient, count: int, password: str) -> List[str]:
+    tokens = []
+    for i in range(count):
+        username = f"bench{i}"
+        await client.post("/register", json={"username": username, "password": password})
+        response = await client.post("/api/login", data={"username": username, "password": password})
+        response.raise_for_status()
+        tokens.append(response.json()["access_token"])
+    return tokens
+
+
+async def drive(args, scenario: str, tokens: List[str]) -> List[Sample]:
+    samples: List[Sample] = []
+    remaining = iter(range(args.requests))
+    ws_base = args.base.replace("http", "ws", 1)
+
+    async def worker(index: int) -> None:
+        token = tokens[index % len(tokens)]
+        async with httpx.AsyncClient(base_url=args.base, timeout=args.timeout) as client:
+            if scenario == "ws":
+                url = f"{ws_base}/ws/ai-question?session_id=bench-{index}"
+                async with websockets.connect(url, open_timeout=args.timeout) as conn:
+                    await conn.send(json.dumps({"type": "auth", "token": token}))
+                    for _ in remaining:
+                        started = time.perf_counter()
+                        try:
+                            samples.append(await asyncio.wait_for(ws_question(conn, started), args.timeout))
+                        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+                            samples.append(Sample(False, None, time.perf_counter() - started))
+                            return
+                return
+            for _ in remaining:
+                if scenario == "sse":
+                    samples.append(await sse_question(client, token))
+                else:
+                    samples.append(await login(client, f"bench{index % len(tokens)}", args.password))
+
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    return samples
+
+
+def report(scenario: str, samples: List[Sample], elapsed: float) -> Dict[str, float]:
+    ok = [s for s in samples if s.ok]
+    ttft = [s.ttft for s in ok if s.ttft is not None]
+    total = [s.total for s in ok]
+    row = {
+        "ok": len(ok),
+        "errors": len(samples) - len(ok),
+        "rps": len(ok) / elapsed if elapsed else 0.0,
+        "tokens_per_s": sum(s.tokens for s in ok) / elapsed if elapsed else 0.0,
+    }
+    for name, values in (("ttft", ttft), ("total", total)):
+        for pct in (50, 95, 99):
+            row[f"{name}_p{pct}"] = percentile(values, pct) * 1000
+    print(
+        f"{scenario:<6} ok={row['ok']:<5} err={row['errors']:<4} {row['rps']:>7.1f} req/s {row['tokens_per_s']:>8.0f} tok/s"
+        f"   ttft p50/p95/p99 = {row['ttft_p50']:.0f}/{row['ttft_p95']:.0f}/{row['ttft_p99']:.0f} ms"
+        f"   total p50/p95/p99 = {row['total_p50']:.0f}/{row['total_p95']:.0f}/{row['total_p99']:.0f} ms"
+    )
+    return row
+
+
+async def wait_port(host: str, port: int, timeout: float = 30.0) -> None:
+    """等待 TCP 端口可连接（MCP / 网关替身没有可直接 GET 的就绪页面）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            await writer.wait_closed()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"服务未就绪: {host}:{port}")
+
+
+async def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"服务未就绪: {url}")
+
+
+def start_processes(args) -> List[subprocess.Popen]:
+    processes = []
+    if args.start_fakes:
+        for script in ("fake_llm.py", "fake_mcp.py", "fake_gateway.py"):
+            processes.append(subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, script)]))
+    if args.start_backend:
+        env = dict(os.environ)
+        env.update({
+            "BASE_URL": "http://127.0.0.1:19101/v1/chat/completions",
+            "SSE_URL": "http://127.0.0.1:19102/sse",
+            "WS_BASE_URL": "http://127.0.0.1:19103",
+            "DATABASE_URL": f"sqlite:///{os.path.join(tempfile.gettempdir(), 'bench_users.db')}",
+            # 替身 LLM 不校验密钥，但后端缺少密钥时会直接返回错误帧
+            "OAI_API_KEY": os.environ.get("OAI_API_KEY", "bench-dummy-key"),
+            "RATE_LIMIT_ENABLED": "0",
+        })
+        port = args.base.rsplit(":", 1)[-1].rstrip("/")
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", port, "--log-level", "warning"],
+            cwd=APP_DIR, env=env,
+        ))
+    return processes
+
+
+async def run(args) -> None:
+    if args.start_fakes:
+        await wait_ready("http://127.0.0.1:19101/docs")
+        await wait_port("127.0.0.1", 19102)
+        await wait_port("127.0.0.1", 19103)
+    await wait_ready(f"{args.base}/docs")
+    async with httpx.AsyncClient(base_url=args.base, timeout=args.timeout) as client:
+        tokens = await setup_users(client, args.users, args.password)
+
+    scenarios = ["login", "sse", "ws"] if args.scenario == "all" else [args.scenario]
+    print(f"concurrency={args.concurrency} requests={args.requests} users={args.users}")
+    for scenario in scenarios:
+        started = time.perf_counter()
+        samples = await drive(args, scenario, tokens)
+        report(scenario, samples, time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base", default="http://127.0.0.1:19069")
+    parser.add_argument("--scenario", choices=["sse", "ws", "login", "all"], default="all")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="每个场景的请求总数")
+    parser.add_argument("--users", type=int, default=4, help="压测用户数，并发按用户轮流分配")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--start-fakes", action="store_true", help="启动本地 LLM / MCP / 网关替身")
+    parser.add_argument("--start-backend", action="store_true", help="以指向替身的配置启动后端")
+    args = parser.parse_args()
+
+    processes = start_processes(args)
+    try:
+        asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -78,9 +78,10 @@ export default function HomePage() {
       const ws = new WebSocket(wsUrl)
       websocketRef.current = ws
 
-      // 连接打开时发送问题
+      // 连接打开时先发送认证帧（token 不放在 URL 中，避免被访问日志记录），再发送问题
       ws.onopen = () => {
         console.log('WebSocket连接已建立')
+        ws.send(JSON.stringify({ type: 'auth', token }))
         ws.send(JSON.stringify({
           question: input.trim(),
           type: 0 // 默认类型
@@ -144,6 +145,11 @@ export default function HomePage() {
       // 连接关闭处理
       ws.onclose = (event) => {
         console.log('WebSocket连接已关闭:', event.code, event.reason)
+        if (event.code === 1008) { // 未携带或携带了无效的 token
+          setMessages(prev => [...prev, { role: 'system', content: '⚠️ 登录已失效，请重新登录' }])
+          setLoading(false)
+          return
+        }
         if (loading) { // 如果关闭时仍在加载状态，说明异常关闭
           setMessages(prev => [...prev, { role: 'system', content: '⚠️ 连接已断开' }])
           setLoading(false)